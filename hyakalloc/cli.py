@@ -5,8 +5,50 @@ of QOSes and their current resource usage, and prints it to stdout in a table.
 
 import argparse
 import getpass
+from datetime import datetime, timedelta
 from hyakalloc.hyakqos import QosResourceQuery
 from hyakalloc.hyakmxcheck import HyakMxCheck
+from hyakalloc.hyakforecast import HyakCkptForecast
+from hyakalloc.hyakadvise import HyakSubmitAdvisor, parse_job_shape
+from hyakalloc.hyakwait import HyakCapacityWait, parse_duration, parse_wait_request
+from hyakalloc import hyakslurm
+from hyakalloc.hyakslurm import parse_gpu_request
+
+def gpu_request_type(gpu_request):
+    """
+    argparse type for "type:count" GPU requests, e.g. "a40:4"
+    """
+    try:
+        return parse_gpu_request(gpu_request)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+def wait_request_type(wait_request):
+    """
+    argparse type for --wait-for requests, e.g. "a40:4" or "a40:4,cpus=32"
+    """
+    try:
+        return parse_wait_request(wait_request)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+def duration_type(duration):
+    """
+    argparse type for durations, e.g. "2h" or "1h30m"
+    """
+    try:
+        return parse_duration(duration)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+def job_shape_type(job_shape):
+    """
+    argparse type for job shapes, e.g. "gpus=2,cpus=16,mem=64G"
+    """
+    try:
+        return parse_job_shape(job_shape)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
 
 def create_parser():
     """
@@ -25,6 +67,15 @@ def create_parser():
                         help="(Optional) Query a specific user.")
     group.add_argument("-g","--group", default='', type=str,
                         help="(Optional) Query a specific group (Hyak Account).")
+    group.add_argument("--forecast", default=None, type=gpu_request_type, metavar="GPU:COUNT",
+                        help="(Optional) Forecast when COUNT GPUs of type GPU free up on one ckpt node, e.g. a40:4.")
+    group.add_argument("--advise", default=None, type=job_shape_type, metavar="SHAPE",
+                        help="(Optional) Rank where to submit a job shaped like gpus=2,cpus=16,mem=64G.")
+    group.add_argument("--wait-for", default=None, type=wait_request_type, metavar="GPU:COUNT[,cpus=N]",
+                        help="(Optional) Wait until one ckpt node has these resources free, then print it and exit 0.")
+    # How long --wait-for waits before giving up
+    parser.add_argument("--max-wait", default="2h", type=duration_type,
+                        help="(Optional) How long --wait-for waits, e.g. 30m or 1h30m. Default is 2h.")
     # Optional partition query argument
     parser.add_argument("-p", "--partition", default='', type=str,
                         help="(Optional) Filter by partition name.")
@@ -37,6 +88,21 @@ def create_parser():
     # Optionally display fairshare value associated with all checkpoint resources
     parser.add_argument("-s","--fairshare", action='store_true',
                         help="(Optional) Display fairshare value associated with all checkpoint resources.")
+    # Latency budget shared by every Slurm command this run makes
+    parser.add_argument("--timeout", default=hyakslurm.DEFAULT_TIMEOUT, type=float,
+                        help="(Optional) Seconds to wait on Slurm before falling back to cached data. "
+                             f"Default is {hyakslurm.DEFAULT_TIMEOUT:g}.")
+    # Optionally leave out ckpt nodes that are reserved before a job of this walltime would end,
+    # for -c, --advise and --wait-for
+    parser.add_argument("--time", default=None, type=duration_type, metavar="WALLTIME",
+                        help="(Optional) Don't count ckpt nodes reserved (e.g. for maintenance) "
+                             "before a job of this walltime would end, e.g. 12:00:00.")
+    # Optionally show pending GPU demand next to the idle GPUs in checkpoint
+    parser.add_argument("-q","--contention", action='store_true',
+                        help="(Optional) Show GPUs requested by pending ckpt jobs and their ratio to idle GPUs.")
+    # Optionally break each QOS's usage down by user
+    parser.add_argument("-b","--breakdown", action='store_true',
+                        help="(Optional) Show per-user usage under each account's resources.")
     # Hidden argument for choosing cluster name, defaults to 'klone'
     parser.add_argument("--cluster", default='klone', type=str,
                         help=argparse.SUPPRESS)
@@ -50,6 +116,7 @@ def main():
     """
 
     arguments = create_parser().parse_args()
+    hyakslurm.set_timeout(arguments.timeout)
 
     checkpoint_only = arguments.ckpt
     run_checkpoint_query = False
@@ -67,6 +134,33 @@ def main():
     query_clustername = arguments.cluster
     debug = arguments.debug
 
+    if arguments.forecast:
+        HyakCkptForecast(*arguments.forecast).print()
+        maintenance = HyakMxCheck()
+        if maintenance.is_upcoming():
+            print(maintenance.notice())
+        return
+
+    if arguments.wait_for:
+        gpu_type = arguments.wait_for[0]
+        node_name = HyakCapacityWait(*arguments.wait_for, walltime=arguments.time).wait(arguments.max_wait)
+        if node_name:
+            print(f"{node_name} {gpu_type}")
+            return 0
+        print(f"Error: No ckpt node had the requested {gpu_type} resources free in time.")
+        return 1
+
+    if arguments.advise:
+        advise_query = QosResourceQuery("user", getpass.getuser(), query_clustername)
+        advise_query.run_query()
+        excluded_nodes = None
+        if arguments.time:
+            excluded_nodes = HyakMxCheck().reserved_nodes(datetime.now() + timedelta(seconds=arguments.time))
+        advise_query.run_ckpt_query(arguments.advise.gpus, True, excluded_nodes)
+        advise_query.run_fairshare_query(getpass.getuser())
+        HyakSubmitAdvisor(advise_query, arguments.advise, excluded_nodes).print()
+        return
+
     if checkpoint_only:
         query_inputs = (None, None, None)
         run_checkpoint_query = True
@@ -87,8 +181,16 @@ def main():
 
     my_query = QosResourceQuery(*query_inputs)
 
+    # One scontrol pass serves both the walltime check and the maintenance notice
+    maintenance = HyakMxCheck()
+
     if run_checkpoint_query:
-        my_query.run_ckpt_query(query_task_gpu_count, query_full_ckpt)
+        excluded_nodes = None
+        if arguments.time:
+            excluded_nodes = maintenance.reserved_nodes(datetime.now() + timedelta(seconds=arguments.time))
+        my_query.run_ckpt_query(query_task_gpu_count, query_full_ckpt, excluded_nodes)
+        if arguments.contention:
+            my_query.run_ckpt_contention_query()
 
     if query_fairshare:
         if not query_user:
@@ -103,10 +205,11 @@ def main():
 
     if not checkpoint_only:
         my_query.run_query()
+        if arguments.breakdown:
+            my_query.run_breakdown_query()
 
     my_query.print()
 
-    maintenance = HyakMxCheck()
     if maintenance.is_upcoming():
         print(maintenance.notice())
 
@@ -0,0 +1,226 @@
+"""
+Rank the places a user could submit a job of a given shape
+"""
+from typing import NamedTuple
+import re
+from rich.console import Console
+from rich.table import Table
+from rich import box
+from hyakalloc.hyakqos import FAVORABLE_GPUS, MEM_UNITS_IN_MB
+from hyakalloc.hyakslurm import SlurmUnavailable, gpu_pattern, run_slurm_command
+
+CKPT_NODE_FLAGS = ["sinfo", "-hNp", "ckpt-all", "-t", "idle,mix", "-O",
+                   "NodeHost:50,CPUsState:30,AllocMem:20,Memory:20,Gres:100,GresUsed:100"]
+
+# mem_pattern regex has 2 groups, for memory sizes like "64G" or "1024":
+# 1. the number and 2. the (optional) unit
+mem_pattern = re.compile(r"(\d+)([MGT]?)B?", re.IGNORECASE)
+
+class JobShape(NamedTuple):
+    gpus: int
+    gpu_type: str
+    cpus: int
+    mem: int  # in MB, like QosResource.resource_data["mem"]
+
+class CkptNode(NamedTuple):
+    name: str
+    gpu_type: str
+    free_gpu: int
+    idle_cpu: int
+    free_mem: int  # in MB
+
+class SubmitOption(NamedTuple):
+    label: str
+    fits: bool
+    favorable_gpu: bool
+    fairshare: float
+    free: str
+    sbatch_flags: str
+
+def parse_job_shape(job_shape: str) -> JobShape:
+    """
+    Takes a string like "gpus=2,cpus=16,mem=64G" (or "gpus=a40:2,...") and
+    returns a JobShape. Anything left out defaults to 0.
+    """
+    shape = {"gpus": 0, "gpu_type": "", "cpus": 0, "mem": 0}
+    for item in job_shape.split(','):
+        key, _, value = item.partition('=')
+        if key == "gpus":
+            gpu_type, _, gpu_count = value.rpartition(':')
+            if not gpu_count.isdigit():
+                raise ValueError(f"Can't parse gpus from '{value}'")
+            shape["gpus"], shape["gpu_type"] = int(gpu_count), gpu_type
+        elif key == "cpus":
+            if not value.isdigit():
+                raise ValueError(f"Can't parse cpus from '{value}'")
+            shape["cpus"] = int(value)
+        elif key == "mem":
+            mem_match = re.fullmatch(mem_pattern, value)
+            if not mem_match:
+                raise ValueError(f"Can't parse mem from '{value}'")
+            shape["mem"] = int(mem_match[1]) * MEM_UNITS_IN_MB[mem_match[2].upper()]
+        else:
+            raise ValueError(f"Unknown job shape field '{key}', expected gpus, cpus or mem")
+    return JobShape(**shape)
+
+def parse_ckpt_nodes(sinfo_output: str) -> list:
+    """
+    Takes the output of CKPT_NODE_FLAGS and returns a CkptNode for every idle
+    or mixed node in ckpt-all.
+    """
+    ckpt_nodes = []
+    for line in sinfo_output.splitlines():
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+        node_name, cpus_state, alloc_mem, total_mem, gres, gres_used = fields[:6]
+        total_gpu = re.search(gpu_pattern, gres)
+        used_gpu = re.search(gpu_pattern, gres_used)
+        gpu_type = (total_gpu[1] or "") if total_gpu else ""
+        try:
+            ckpt_nodes.append(CkptNode(
+                node_name,
+                gpu_type,
+                (int(total_gpu[2]) if total_gpu else 0) - (int(used_gpu[2]) if used_gpu else 0),
+                int(cpus_state.split('/')[1]),
+                int(total_mem) - int(alloc_mem)))
+        except (IndexError, ValueError):
+            continue
+    return ckpt_nodes
+
+class HyakSubmitAdvisor:
+    """
+    Takes a QosResourceQuery that has already run run_query(), run_ckpt_query()
+    and run_fairshare_query(), and a JobShape. Every QOS in qos_resource_dict and
+    every ckpt GPU type gets evaluated once. A ckpt option only fits if a single
+    node has the GPUs, CPUs and memory free together, which takes one more
+    per-node sinfo call, and nodes in excluded_nodes (e.g. reserved for
+    maintenance before the job would end) never count. The options are ranked by:
+        1. whether the job fits right now
+        2. whether the GPU type is in FAVORABLE_GPUS
+        3. the account's ckpt fairshare
+
+    Provides two public methods:
+
+    1. options(), which returns the ranked list of SubmitOption tuples.
+
+    2. print(), which prints the options and their sbatch flags in a table.
+    """
+    def __init__(self, query, job_shape: JobShape, excluded_nodes=None) -> None:
+        self.query = query
+        self.job_shape = job_shape
+        self.excluded_nodes = excluded_nodes or set()
+        self.ckpt_nodes = []
+        self.ckpt_note = ""
+        self.__ckpt_nodes_run()
+
+    def __ckpt_nodes_run(self):
+        try:
+            sinfo_output = run_slurm_command(CKPT_NODE_FLAGS)
+        except SlurmUnavailable as error:
+            self.ckpt_note = f"ckpt nodes unavailable, {error}"
+            return
+        self.ckpt_note = sinfo_output.stale_note()
+        self.ckpt_nodes = parse_ckpt_nodes(sinfo_output.stdout)
+
+    def __ckpt_fits(self, gpu_type):
+        """
+        Returns whether one ckpt node (with gpu_type GPUs, if given) has the
+        whole job shape free.
+        """
+        return any(
+            node.name not in self.excluded_nodes
+            and (not gpu_type or node.gpu_type == gpu_type)
+            and node.free_gpu >= self.job_shape.gpus
+            and node.idle_cpu >= max(self.job_shape.cpus, 1)
+            and node.free_mem >= self.job_shape.mem
+            for node in self.ckpt_nodes)
+
+    def __resource_flags(self, gpu_type):
+        flags = []
+        if self.job_shape.gpus:
+            flags.append(f"--gpus={gpu_type + ':' if gpu_type else ''}{self.job_shape.gpus}")
+        if self.job_shape.cpus:
+            flags.append(f"-c {self.job_shape.cpus}")
+        if self.job_shape.mem:
+            flags.append(f"--mem={self.job_shape.mem // 1024}G" if self.job_shape.mem % 1024 == 0
+                         else f"--mem={self.job_shape.mem}M")
+        return flags
+
+    def __qos_option(self, qos_name, qos_data):
+        resource_data = qos_data.resource_data
+        free = {resource: resource_data.get(resource, {}).get("free", 0)
+                for resource in ("cpu", "mem", "gpu")}
+        gpu_type = qos_name.split('-')[-1] if self.job_shape.gpus else ""
+        fits = free["cpu"] >= self.job_shape.cpus \
+            and free["mem"] >= self.job_shape.mem \
+            and free["gpu"] >= self.job_shape.gpus \
+            and (not self.job_shape.gpu_type or gpu_type == self.job_shape.gpu_type)
+        sbatch_flags = " ".join(
+            [f"-A {qos_data.account}", f"-p {qos_data.partition}", f"--qos={qos_name}"]
+            + self.__resource_flags(""))
+        return SubmitOption(
+            f"{qos_data.account} / {qos_data.partition}",
+            fits,
+            gpu_type in FAVORABLE_GPUS,
+            self.query.ckpt_fairshare_by_account.get(qos_data.account, 0.0),
+            f"{free['cpu']} cpu, {int(free['mem']/1024)}G, {free['gpu']} gpu",
+            sbatch_flags)
+
+    def __ckpt_options(self):
+        ckpt_accounts = self.query.ckpt_fairshare_by_account or {"": 0.0}
+        if self.job_shape.gpus:
+            gpu_types = [self.job_shape.gpu_type] if self.job_shape.gpu_type \
+                else list(self.query.ckpt_free_gpu_by_type)
+        else:
+            gpu_types = [""]
+        for gpu_type in gpu_types:
+            fits = self.__ckpt_fits(gpu_type)
+            if gpu_type:
+                free = f"{self.query.ckpt_free_gpu_by_type.get(gpu_type, 0)} {gpu_type} gpu"
+            else:
+                free_cpu = int(self.query.ckpt_free_cpu) if self.query.ckpt_free_cpu.isdigit() else 0
+                free = f"{free_cpu} cpu"
+            for account, fairshare in ckpt_accounts.items():
+                account_flags = [f"-A {account}-ckpt"] if account else []
+                sbatch_flags = " ".join(
+                    account_flags + ["-p ckpt-all"] + self.__resource_flags(gpu_type))
+                yield SubmitOption(
+                    f"{account + ' / ' if account else ''}ckpt-all{' ' + gpu_type if gpu_type else ''}",
+                    fits,
+                    gpu_type in FAVORABLE_GPUS,
+                    fairshare,
+                    free,
+                    sbatch_flags)
+
+    def options(self):
+        """
+        Returns the ranked list of SubmitOption tuples.
+        """
+        submit_options = [self.__qos_option(qos_name, qos_data)
+                          for qos_name, qos_data in self.query.qos_resource_dict.items()]
+        submit_options.extend(self.__ckpt_options())
+        submit_options.sort(reverse=True,
+            key=lambda option: (option.fits, option.favorable_gpu, option.fairshare))
+        return submit_options
+
+    def print(self):
+        """
+        Prints the ranked options and their sbatch flags in a table.
+        """
+        table = Table(title="Where to submit", box=box.ROUNDED)
+        if self.ckpt_note:
+            table.caption = f"({self.ckpt_note})"
+        table.add_column("", justify="right")
+        table.add_column("Option", justify="right")
+        table.add_column("Free", justify="right")
+        table.add_column("Fits", justify="right")
+        table.add_column("sbatch flags")
+        for rank, option in enumerate(self.options(), start=1):
+            table.add_row(str(rank), option.label, option.free,
+                          "yes" if option.fits else "no", option.sbatch_flags)
+        if table.rows:
+            console = Console()
+            console.print(table)
+        else:
+            print("Error: No accounts or ckpt resources available.")
@@ -0,0 +1,175 @@
+"""
+hyakapi is an asyncio library layer over the same Slurm queries that
+hyakalloc prints. Nothing here prints or exits: results come back as
+NamedTuples and failures are raised as SlurmCommandError.
+
+    import asyncio
+    from hyakalloc import hyakapi
+    qos_usage = asyncio.run(hyakapi.get_qos_usage("alice"))
+
+Concurrent callers asking for the same Slurm command share one subprocess.
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+import asyncio
+import getpass
+from hyakalloc.hyakqos import (
+    CKPT_JOB_LIMIT_FLAGS, CKPT_SINFO_FLAGS, filter_qos_by_cluster, parse_ckpt_sinfo,
+    parse_grptres, split_qos_name
+)
+from hyakalloc.hyakmxcheck import SCONTROL_RES_FLAGS, parse_reservations
+
+SLURM_TIMEFORMAT = '%Y-%m-%dT%H:%M:%S'
+COMMAND_TIMEOUT = 10.0
+
+class SlurmCommandError(RuntimeError):
+    """
+    Raised when a Slurm command can't be run, times out, exits non-zero, or
+    returns output that can't be parsed.
+    """
+
+class ResourceUsage(NamedTuple):
+    total: int
+    used: int
+    free: int
+
+class QosUsage(NamedTuple):
+    qos: str
+    account: str
+    partition: str
+    cpu: ResourceUsage
+    mem: ResourceUsage  # in MB
+    gpu: ResourceUsage
+
+class GpuCapacity(NamedTuple):
+    gpu_type: str
+    free: int
+    total: int
+    tasks: int  # task_gpu_count-sized tasks that fit, 0 if not asked for
+
+class CkptCapacity(NamedTuple):
+    free_cpu: int
+    gpus: tuple  # of GpuCapacity
+    job_limit: Optional[int]
+
+class Reservation(NamedTuple):
+    name: str
+    start: Optional[datetime]
+    end: Optional[datetime]
+    nodes: str
+    flags: tuple
+
+# Slurm command tuple -> running asyncio.Task, so that concurrent callers
+# share one subprocess instead of each starting their own.
+_in_flight = {}
+
+async def _exec_command(command: tuple, timeout: float) -> str:
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except OSError as error:
+        raise SlurmCommandError(f"Couldn't run '{command[0]}': {error}") from error
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError as error:
+        process.kill()
+        await process.wait()
+        raise SlurmCommandError(f"'{' '.join(command)}' didn't finish in {timeout:g}s") from error
+    if process.returncode != 0:
+        raise SlurmCommandError(
+            f"'{' '.join(command)}' exited with {process.returncode}: "
+            f"{stderr.decode('utf-8', 'replace').strip()}")
+    return stdout.decode('utf-8', 'replace')
+
+async def run_slurm_command(command: list, timeout: float = COMMAND_TIMEOUT) -> str:
+    """
+    Runs a Slurm command and returns its stdout. If the same command is
+    already running, waits for that one instead of starting another. A caller
+    being cancelled doesn't cancel the command for the other callers, but a
+    command still running after timeout seconds is killed, so a hung one
+    can't hold up everyone who asks for it later.
+    """
+    command = tuple(command)
+    task = _in_flight.get(command)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.ensure_future(_exec_command(command, timeout))
+        _in_flight[command] = task
+        task.add_done_callback(lambda _: _in_flight.pop(command, None))
+    return await asyncio.shield(task)
+
+def _resource_usage(resource_data: dict, resource: str) -> ResourceUsage:
+    usage = resource_data.get(resource, {"total": 0, "used": 0, "free": 0})
+    return ResourceUsage(usage["total"], usage["used"], usage["free"])
+
+async def _get_single_qos_usage(qos_name: str) -> QosUsage:
+    scontrol_output = await run_slurm_command(
+        ["scontrol", "show", "assoc_mgr", "flags=qos", "qos=" + qos_name])
+    try:
+        resource_data = parse_grptres(scontrol_output)
+    except LookupError as error:
+        raise SlurmCommandError(f"No GrpTRES limits found for QOS '{qos_name}'") from error
+    account, partition = split_qos_name(qos_name)
+    return QosUsage(qos_name, account, partition,
+                    _resource_usage(resource_data, "cpu"),
+                    _resource_usage(resource_data, "mem"),
+                    _resource_usage(resource_data, "gpu"))
+
+async def get_qos_usage(user: str = None, cluster: str = "klone") -> list:
+    """
+    Returns a list of QosUsage for every (non-ckpt) QOS the user can submit to,
+    defaulting to the current user. All QOSes are queried concurrently.
+    """
+    if user is None:
+        user = getpass.getuser()
+    if not user.isalnum():
+        raise ValueError("User should be alphanumeric, no spaces or special characters.")
+    sacctmgr_output = await run_slurm_command(
+        ["sacctmgr", "show", "user", user, "-nPs", "format=cluster,qos"])
+    qos_names = []
+    for qos_name in filter_qos_by_cluster(sacctmgr_output, cluster):
+        if qos_name and qos_name not in qos_names \
+            and "ckpt" not in qos_name and "normal" not in qos_name:
+            qos_names.append(qos_name)
+    return list(await asyncio.gather(*map(_get_single_qos_usage, qos_names)))
+
+async def get_ckpt_capacity(task_gpu_count: int = 0) -> CkptCapacity:
+    """
+    Returns the idle CPUs and GPUs (by type) in ckpt-all, along with the
+    ckpt job limit if there is one. The job limit is optional, so if it can't
+    be looked up it's None rather than an error.
+    """
+    sinfo_output, job_limit_output = await asyncio.gather(
+        run_slurm_command(CKPT_SINFO_FLAGS), run_slurm_command(CKPT_JOB_LIMIT_FLAGS),
+        return_exceptions=True)
+    if isinstance(sinfo_output, BaseException):
+        raise sinfo_output
+    if isinstance(job_limit_output, SlurmCommandError):
+        job_limit_output = ""
+    elif isinstance(job_limit_output, BaseException):
+        raise job_limit_output
+    free_cpu, free_gpu, all_gpu, gpu_tasks = parse_ckpt_sinfo(sinfo_output, task_gpu_count)
+    gpus = tuple(GpuCapacity(gpu_type, free_gpu[gpu_type], all_gpu[gpu_type], gpu_tasks.get(gpu_type, 0))
+                 for gpu_type in sorted(all_gpu))
+    job_limit = job_limit_output.strip()
+    return CkptCapacity(free_cpu, gpus, int(job_limit) if job_limit.isdigit() else None)
+
+def _parse_slurm_time(slurm_time: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(slurm_time, SLURM_TIMEFORMAT)
+    except (TypeError, ValueError):
+        return None
+
+async def get_reservations() -> list:
+    """
+    Returns every Slurm reservation as a Reservation, sorted by start time.
+    """
+    scontrol_output = await run_slurm_command(SCONTROL_RES_FLAGS)
+    reservations = [
+        Reservation(reservation_data.get("ReservationName", ""),
+                    _parse_slurm_time(reservation_data.get("StartTime")),
+                    _parse_slurm_time(reservation_data.get("EndTime")),
+                    reservation_data.get("Nodes", ""),
+                    tuple(filter(None, reservation_data.get("Flags", "").split(','))))
+        for reservation_data in parse_reservations(scontrol_output)]
+    reservations.sort(key=lambda reservation: reservation.start or datetime.max)
+    return reservations
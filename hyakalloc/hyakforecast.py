@@ -0,0 +1,175 @@
+"""
+Forecast when ckpt GPUs will be released by running jobs
+"""
+from collections import defaultdict
+from datetime import datetime
+import math
+import re
+from rich.console import Console
+from rich.table import Table
+from rich import box
+from hyakalloc.hyakslurm import SlurmUnavailable, expand_hostlist, gpu_pattern, run_slurm_command
+
+SLURM_TIMEFORMAT = '%Y-%m-%dT%H:%M:%S'
+# Nodes in these states won't be handing out GPUs no matter when jobs end
+UNAVAILABLE_NODE_STATES = ('down', 'drain', 'drng', 'fail', 'maint', 'resv', 'inval')
+
+# tres_gpu_pattern regex has 2 groups, for tres-alloc entries like "gres/gpu=4"
+# or "gres/gpu:a40=4": 1. the (optional) gpu type and 2. the count
+tres_gpu_pattern = re.compile(r"gres/gpu(?::([a-zA-Z]\w*))?=(\d+)")
+
+class HyakCkptForecast:
+    """
+    Joins the per-node GRES usage in ckpt-all (`sinfo -N`) against the end
+    times of running ckpt jobs (`squeue -t R`), and sweeps through the job end
+    events to find when each node will have gpu_count GPUs of gpu_type free.
+
+    A job's GPUs per node come from tres-per-node, or from its tres-alloc
+    split across its nodes when it asked with --gpus or --gpus-per-task.
+    GPUs held by jobs outside of ckpt-all have no known end time, so they're
+    treated as never being released.
+
+    Provides two public methods:
+
+    1. timeline(), which returns a sorted list of (datetime, node count) tuples,
+    where node count is how many nodes have the requested GPUs free at that time.
+
+    2. print(), which prints the timeline in a table.
+    """
+    def __init__(self, gpu_type: str, gpu_count: int) -> None:
+        self.gpu_type = gpu_type
+        self.gpu_count = gpu_count
+        self.now = datetime.now()
+        # node name -> [total gpus, used gpus]
+        self.node_gpus = {}
+        # node name -> list of (end time, gpus released)
+        self.node_releases = defaultdict(list)
+        self.unavailable_note = ""
+        self.__parse_sinfo(self.__sinfo_run())
+        self.__parse_squeue(self.__squeue_run())
+
+    def __sinfo_run(self):
+        sinfo_flags = ["sinfo", "-hNp", "ckpt-all", "-O",
+                       "NodeHost:50,StateCompact:20,Gres:100,GresUsed:100"]
+        try:
+            return run_slurm_command(sinfo_flags).stdout
+        except SlurmUnavailable as error:
+            self.unavailable_note = str(error)
+            return ""
+
+    def __squeue_run(self):
+        squeue_flags = ["squeue", "-h", "-p", "ckpt-all", "-t", "R", "-O",
+                        "EndTime:25,NodeList:500,tres-per-node:100,tres-alloc:300"]
+        try:
+            return run_slurm_command(squeue_flags).stdout
+        except SlurmUnavailable as error:
+            self.unavailable_note = str(error)
+            return ""
+
+    def __parse_sinfo(self, sinfo_output):
+        for line in sinfo_output.splitlines():
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            node_name, node_state, gres, gres_used = fields[:4]
+            if node_state.rstrip('*~#!%$@^-+').lower() in UNAVAILABLE_NODE_STATES:
+                continue
+            total_gpu = re.search(gpu_pattern, gres)
+            if not total_gpu or total_gpu[1] != self.gpu_type:
+                continue
+            used_gpu = re.search(gpu_pattern, gres_used)
+            self.node_gpus[node_name] = [int(total_gpu[2]), int(used_gpu[2]) if used_gpu else 0]
+
+    def __job_gpus_per_node(self, tres_per_node, tres_alloc, node_count):
+        """
+        Returns the GPUs of gpu_type a job holds on each of its nodes, or 0.
+        Jobs that asked with --gpus or --gpus-per-task have no gpu in
+        tres-per-node, so their allocated GPUs get split across their nodes.
+        """
+        per_node = re.search(gpu_pattern, tres_per_node)
+        if per_node:
+            return int(per_node[2]) if per_node[1] in (None, self.gpu_type) else 0
+        alloc_gpus = dict(re.findall(tres_gpu_pattern, tres_alloc))
+        typed_gpus = {gpu_type: count for gpu_type, count in alloc_gpus.items() if gpu_type}
+        if typed_gpus:
+            job_gpus = int(typed_gpus.get(self.gpu_type, 0))
+        else:
+            job_gpus = int(alloc_gpus.get("", 0))
+        return job_gpus // max(node_count, 1)
+
+    def __parse_squeue(self, squeue_output):
+        end_times = {}
+        for line in squeue_output.splitlines():
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            end_time_string, node_list, tres_per_node, tres_alloc = fields[:4]
+            node_names = expand_hostlist(node_list)
+            gpus_per_node = self.__job_gpus_per_node(tres_per_node, tres_alloc, len(node_names))
+            if not gpus_per_node:
+                continue
+            if end_time_string not in end_times:
+                try:
+                    end_times[end_time_string] = max(
+                        datetime.strptime(end_time_string, SLURM_TIMEFORMAT), self.now)
+                except ValueError:
+                    end_times[end_time_string] = None
+            end_time = end_times[end_time_string]
+            if end_time is None:
+                continue
+            for node_name in node_names:
+                if node_name in self.node_gpus:
+                    self.node_releases[node_name].append((end_time, gpus_per_node))
+
+    def __node_available_time(self, node_name):
+        """
+        Returns the first time that node_name has gpu_count GPUs free, or None
+        if the known job end times never free up enough.
+        """
+        total_gpu, used_gpu = self.node_gpus[node_name]
+        free_gpu = total_gpu - used_gpu
+        if free_gpu >= self.gpu_count:
+            return self.now
+        for end_time, released_gpu in sorted(self.node_releases[node_name]):
+            free_gpu += released_gpu
+            if free_gpu >= self.gpu_count:
+                return end_time
+        return None
+
+    def timeline(self):
+        """
+        Returns a list of (datetime, node count) tuples, sorted by time.
+        """
+        available_times = sorted(
+            available_time for available_time in map(self.__node_available_time, self.node_gpus)
+            if available_time is not None)
+        timeline = []
+        for node_count, available_time in enumerate(available_times, start=1):
+            if timeline and timeline[-1][0] == available_time:
+                timeline[-1] = (available_time, node_count)
+            else:
+                timeline.append((available_time, node_count))
+        return timeline
+
+    def print(self, max_rows=10):
+        """
+        Prints the first max_rows entries of the timeline in a table.
+        """
+        table_title = f"Forecast for {self.gpu_count}x {self.gpu_type} on one ckpt node"
+        table = Table(title=table_title, box=box.ROUNDED)
+        table.add_column("Free at", justify="right")
+        table.add_column("Nodes", justify="right")
+        for available_time, node_count in self.timeline()[:max_rows]:
+            if available_time == self.now:
+                time_string = "now"
+            else:
+                minutes = math.ceil((available_time - self.now).total_seconds() / 60)
+                time_string = f"{available_time.strftime('%I:%M%p %a')} (+{minutes // 60}h{minutes % 60:02d}m)"
+            table.add_row(time_string, f"{node_count}/{len(self.node_gpus)}")
+        if table.rows:
+            console = Console()
+            console.print(table)
+        elif self.unavailable_note:
+            print(f"Error: ckpt forecast unavailable, {self.unavailable_note}.")
+        else:
+            print(f"Error: No {self.gpu_type} nodes in ckpt will free up {self.gpu_count} GPUs.")
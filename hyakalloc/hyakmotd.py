@@ -0,0 +1,201 @@
+"""
+hyakmotd prints the login banner: the ckpt summary, the user's account
+resources, the maintenance notice and home/gscratch storage usage.
+
+Everything is collected concurrently in one process under a hard time budget.
+Slurm sections that don't finish in time are answered from hyakslurm's cache
+of the same commands, and storage falls back to the last storage report this
+tool saw. Anything with no cache is left out, so the banner never holds up a
+login. Sections that didn't finish are then refreshed by a detached child
+process with a longer timeout, so the next login has data to show.
+"""
+import argparse
+import getpass
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+from hyakalloc import hyakslurm
+from hyakalloc.hyakqos import QosResourceQuery
+from hyakalloc.hyakmxcheck import HyakMxCheck
+from hyakstorage import cli as hyakstorage
+
+DEFAULT_BUDGET = 0.5
+# Slurm gets this fraction of the budget, leaving time to fall back & print
+SLURM_BUDGET_SHARE = 0.8
+# The detached refresh isn't holding up a login, so it can wait on Slurm
+REFRESH_TIMEOUT = 60
+SECTION_NAMES = ("ckpt", "qos", "maintenance", "storage")
+
+def create_parser():
+    """
+    Generate command line options and help text.
+    Input: None
+    Output: ArgParse parser object
+    """
+    parser = argparse.ArgumentParser(prog="hyak-motd",
+        description='Prints a summary of Hyak resources and storage for the login banner.')
+    parser.add_argument("--budget", default=DEFAULT_BUDGET, type=float,
+                        help=f"(Optional) Seconds to spend collecting. Default is {DEFAULT_BUDGET:g}.")
+    parser.add_argument("--cluster", default='klone', type=str,
+                        help=argparse.SUPPRESS)
+    # Used by the detached child that refreshes the caches of slow sections
+    parser.add_argument("--refresh", action='append', default=[], choices=SECTION_NAMES,
+                        help=argparse.SUPPRESS)
+    return parser
+
+def collect_ckpt():
+    ckpt_query = QosResourceQuery(None, None, None)
+    ckpt_query.run_ckpt_query(0, False)
+    return ckpt_query
+
+def collect_qos(user, cluster):
+    qos_query = QosResourceQuery("user", user, cluster)
+    qos_query.run_query()
+    return qos_query
+
+def collect_maintenance():
+    return HyakMxCheck()
+
+def collect_storage():
+    """
+    Returns the home & gscratch usage tables, and caches them for the next
+    login in case storage is slow then.
+    """
+    storage_arguments = argparse.Namespace(
+        show_usage_by_group=False, show_usage_by_user=False, sort_by_disk=True, sort_by_files=False)
+    storage_tables = [hyakstorage.make_homedir_report_table()]
+    storage_tables += hyakstorage.make_my_gscratch_dirs_report_tables(storage_arguments)
+    storage_tables = [table for table in storage_tables if table]
+    hyakstorage.write_report_tables_cache(storage_tables)
+    return storage_tables
+
+def read_cached_storage():
+    storage_tables, cached_at = hyakstorage.read_report_tables_cache()
+    if storage_tables is None:
+        return None, ""
+    return storage_tables, "cached data from " + time.strftime('%I:%M%p', time.localtime(cached_at))
+
+class SectionCollector(threading.Thread):
+    """
+    Runs one section's collect function in a daemon thread, so that a section
+    that's still stuck (e.g. on GPFS) when the budget runs out can't keep the
+    process from exiting.
+    """
+    def __init__(self, collect, *args):
+        super().__init__(daemon=True)
+        self.collect = collect
+        self.args = args
+        self.result = None
+
+    def run(self):
+        try:
+            self.result = self.collect(*self.args)
+        except Exception:
+            self.result = None
+
+def make_sections(user, cluster):
+    """
+    Returns { section name : (collect function, its arguments) }.
+    """
+    return {
+        "ckpt": (collect_ckpt, ()),
+        "qos": (collect_qos, (user, cluster)),
+        "maintenance": (collect_maintenance, ()),
+        "storage": (collect_storage, ()),
+    }
+
+def collect_from_cache(collect, args):
+    """
+    Runs a Slurm section's collect function with no time left in the budget,
+    so every command is answered from the cache (or raises).
+    """
+    hyakslurm.set_timeout(0)
+    try:
+        return collect(*args)
+    except Exception:
+        return None
+
+def start_refresh(section_names, cluster):
+    """
+    Starts a detached child that collects section_names again with a longer
+    timeout, filling the caches for the next login. Nothing waits on it.
+    """
+    refresh_flags = [sys.executable, "-m", "hyakalloc.hyakmotd", "--cluster", cluster]
+    for section_name in section_names:
+        refresh_flags += ["--refresh", section_name]
+    try:
+        subprocess.Popen(refresh_flags, cwd=pathlib.Path(__file__).resolve().parent.parent,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+    except OSError:
+        pass
+
+def refresh(section_names, user, cluster):
+    """
+    Collects section_names one after another, only for the caches they fill.
+    """
+    sections = make_sections(user, cluster)
+    hyakslurm.set_timeout(REFRESH_TIMEOUT, command_share=1.0)
+    for section_name in section_names:
+        collect, args = sections[section_name]
+        try:
+            collect(*args)
+        except Exception:
+            continue
+
+def main():
+    """
+    Start collecting every section, wait out the budget, answer whatever
+    didn't finish from cache, print, and refresh the slow sections in the
+    background.
+    """
+    arguments = create_parser().parse_args()
+    user = getpass.getuser()
+    if arguments.refresh:
+        refresh(arguments.refresh, user, arguments.cluster)
+        return
+    deadline = time.monotonic() + arguments.budget
+    # Every command gets a single try with all of the budget that's left
+    hyakslurm.set_timeout(arguments.budget * SLURM_BUDGET_SHARE, command_share=1.0)
+
+    sections = make_sections(user, arguments.cluster)
+    collectors = {section_name: SectionCollector(collect, *args)
+                  for section_name, (collect, args) in sections.items()}
+    for collector in collectors.values():
+        collector.start()
+    for collector in collectors.values():
+        collector.join(max(deadline - time.monotonic(), 0))
+
+    unfinished = [section_name for section_name, collector in collectors.items() if collector.is_alive()]
+    # Slurm sections that finished on cached data need a refresh too
+    refresh_sections = unfinished if not hyakslurm.fell_back() \
+        else sorted(set(unfinished) | {"ckpt", "qos", "maintenance"}, key=SECTION_NAMES.index)
+    results = {section_name: collector.result for section_name, collector in collectors.items()
+               if section_name not in unfinished}
+    for section_name in unfinished:
+        if section_name != "storage":
+            results[section_name] = collect_from_cache(*sections[section_name])
+
+    ckpt, qos, maintenance = results.get("ckpt"), results.get("qos"), results.get("maintenance")
+    if ckpt:
+        ckpt.print()
+    if qos and qos.qos_resource_dict:
+        qos.print()
+    if results.get("storage") is not None:
+        storage_tables, storage_note = results["storage"], ""
+    else:
+        storage_tables, storage_note = read_cached_storage()
+    for table in storage_tables or []:
+        hyakstorage.print_usage_table(table)
+    if storage_note:
+        print(f"(storage usage is {storage_note})")
+    if maintenance and maintenance.is_upcoming():
+        print(maintenance.notice())
+
+    if refresh_sections:
+        start_refresh(refresh_sections, arguments.cluster)
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,33 @@
 Report on upcoming maintenances
 """
 import re
-import subprocess
 from datetime import datetime
+from hyakalloc.hyakslurm import SlurmUnavailable, expand_hostlist, run_slurm_command
+
+SCONTROL_RES_FLAGS = ["scontrol", "show", "res", "-ov"]
+SLURM_TIMEFORMAT = '%Y-%m-%dT%H:%M:%S'
+
+class AllNodes:
+    """
+    Stands in for the set of every node when an ALL_NODES reservation applies.
+    """
+    def __contains__(self, node_name):
+        return True
+
+    def __bool__(self):
+        return True
+
+def parse_reservations(scontrol_output):
+    """
+    Takes the output of `scontrol show res -ov` and returns a list of
+    dictionaries, one per reservation, e.g.:
+    [{ "ReservationName" : "mx", "StartTime" : "2024-01-09T09:00:00", ... }]
+    """
+    reservation_line_pattern = re.compile(r"ReservationName.*")
+    reservation_data_pattern = re.compile(r"(\w*)=(\S*)")
+
+    reservation_lines = re.findall(reservation_line_pattern, scontrol_output)
+    return [dict(re.findall(reservation_data_pattern, line)) for line in reservation_lines]
 
 class HyakMxCheck:
     """
@@ -12,21 +37,26 @@ class HyakMxCheck:
     objects: self.next_mx_start_date and self.next_mx_end_date for the start
     and end times of the next maintenance.
 
-    Provides two public methods:
+    Provides three public methods:
 
     1. is_upcoming(timeframe) which returns True/False
     depending on if the next mx is within the provided timeframe (7 days, if blank).
 
     2. notice(), which returns a string for printing with readable dates:
         'Notice: Klone will be down for maintenance between\n %s and %s'
+
+    3. reserved_nodes(until), which returns the nodes in any reservation
+    (including ones that cover only some nodes) that starts before until.
     """
     def __init__(self) -> None:
+        self.all_reservations = []
         self.reservation_list = []
+        self.next_mx_start_date = None
         self.__generate_reservation_list()
         self.__sort_reservation_list()
 
-        next_mx = self.reservation_list[0]
-        if next_mx:
+        if self.reservation_list:
+            next_mx = self.reservation_list[0]
             slurm_timeformat = '%Y-%m-%dT%H:%M:%S'
             self.next_mx_start_date = datetime.strptime(next_mx['StartTime'], slurm_timeformat)
 
@@ -35,22 +65,16 @@ class HyakMxCheck:
         self.reservation_list.sort(key = slurm_date_key)
 
     def __parse_scontrol(self, scontrol_output):
-        reservation_line_pattern = re.compile(r"ReservationName.*")
-        reservation_data_pattern = re.compile(r"(\w*)=(\S*)")
-
-        reservation_lines = re.findall(reservation_line_pattern, scontrol_output)
-        for line in reservation_lines:
-            # 1. Make a dictionary of the reservation data
-            reservation_data = dict(re.findall(reservation_data_pattern, line))
-            # 2. Append the reservation list with that dictionary.
-            if 'ALL_NODES' in reservation_data['Flags']:
+        self.all_reservations = parse_reservations(scontrol_output)
+        for reservation_data in self.all_reservations:
+            if 'ALL_NODES' in reservation_data.get('Flags', ''):
                 self.reservation_list.append(reservation_data)
 
     def __scontrol_run(self):
-        scontrol_flags = ["scontrol", "show", "res", "-ov"]
-        scontrol_output = subprocess.run(scontrol_flags, capture_output=True,
-            encoding='utf-8', check=False).stdout
-        return scontrol_output
+        try:
+            return run_slurm_command(SCONTROL_RES_FLAGS).stdout
+        except SlurmUnavailable:
+            return ""
 
     def __generate_reservation_list(self):
         self.__parse_scontrol(self.__scontrol_run())
@@ -62,6 +86,8 @@ class HyakMxCheck:
         """
         now = datetime.now()
         next_mx = self.next_mx_start_date
+        if next_mx is None:
+            return False
         days_until_next_mx = abs((next_mx - now).days)
 
         if  days_until_next_mx <= timeframe:
@@ -69,6 +95,28 @@ class HyakMxCheck:
         else:
             return False
 
+    def reserved_nodes(self, until):
+        """
+        Returns the set of nodes held by reservations that start before until
+        (a datetime) and haven't ended yet, or AllNodes() if one of them is an
+        ALL_NODES reservation. Nodes are left out whole, even if a reservation
+        only holds some of their cores.
+        """
+        now = datetime.now()
+        nodes = set()
+        for reservation_data in self.all_reservations:
+            try:
+                start = datetime.strptime(reservation_data['StartTime'], SLURM_TIMEFORMAT)
+                end = datetime.strptime(reservation_data['EndTime'], SLURM_TIMEFORMAT)
+            except (KeyError, ValueError):
+                continue
+            if start >= until or end <= now:
+                continue
+            if 'ALL_NODES' in reservation_data.get('Flags', ''):
+                return AllNodes()
+            nodes.update(expand_hostlist(reservation_data.get('Nodes', '')))
+        return nodes
+
     def notice (self):
         """
         Returns a string describing the next maintenance.
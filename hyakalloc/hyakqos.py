@@ -3,22 +3,196 @@ hyakqos contains the QosResourceQuery class, and the QosResource class
 """
 
 from collections import defaultdict
+import io
 import re
-import subprocess
 import pwd
 import grp
 import sys
 from rich.console import Console
 from rich.table import Table
 from rich import box
+from hyakalloc.hyakslurm import (
+    SlurmUnavailable, expand_hostlist, gpu_pattern, run_slurm_command, stream_slurm_command)
 
 FAVORABLE_GPUS = ['a100', 'a40', 'l40', 'l40s']
+MEM_UNITS_IN_MB = {"": 1, "M": 1, "G": 1024, "T": 1024 * 1024}
+
+CKPT_SINFO_FLAGS = ["sinfo", "-hp", "ckpt-all", "-O", "Nodes,CPUsState,Gres,GresUsed,NodeList:5000"]
+CKPT_PENDING_FLAGS = ["squeue", "-h", "-p", "ckpt-all", "-t", "PD", "-O",
+                      "tres-per-node:100,tres-per-job:100,NumNodes:10"]
+QOS_RUNNING_FLAGS = ["squeue", "-h", "-t", "R", "-O", "UserName:30,QOS:60,tres-alloc:200"]
+CKPT_JOB_LIMIT_FLAGS = [
+    "/usr/bin/sacctmgr", "show", "association", "where", "account=ckpt", "format=GrpJobs", "--noheader", "--parsable2"
+    ]
+
+# Regex matches groups from sinfo lines like:
+#   81/39/0/120         gpu:2080ti:8        gpu:2080ti:8(IDX:0-7
+#   3072/10232/160/13464(null)              gpu:0
+# and retrieves:
+# 1. the number of nodes
+# 2. the second column (avail cpus) of the */*/*/*,
+# 3. the final column (total gpus) of gpu:2080ti:X
+# 4. the final column (used gpus) of gpu:2080ti:8(IDX:0-7
+sinfo_pattern = re.compile(
+    r"(\d*) *\d*\/(\d*)\/\d*\/\d*(?:\(\w*\)|) *(?:gpu:(\w*):|)(\d|) *(?:gpu:\w*:|)(\d|)")
+
+def aggregate_pending_gpus(squeue_lines) -> dict:
+    """
+    Takes the lines of CKPT_PENDING_FLAGS output (any iterable, so they can be
+    streamed) and returns the pending gpus by type. Jobs that don't ask for a
+    GPU type are counted under "any".
+    """
+    pending_gpu = defaultdict(int)
+    for line in squeue_lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        tres_per_node, tres_per_job, num_nodes = fields[:3]
+        per_node = re.search(gpu_pattern, tres_per_node)
+        if per_node:
+            gpu_type = per_node[1] or "any"
+            job_gpus = int(per_node[2]) * (int(num_nodes) if num_nodes.isdigit() else 1)
+        else:
+            per_job = re.search(gpu_pattern, tres_per_job)
+            if not per_job:
+                continue
+            gpu_type, job_gpus = per_job[1] or "any", int(per_job[2])
+        pending_gpu[gpu_type] += job_gpus
+    return dict(pending_gpu)
+
+def format_contention(pending: int, free: int) -> str:
+    """
+    Returns pending demand next to its contention ratio, e.g. "24 (3.0x)".
+    """
+    if not pending:
+        return "0"
+    ratio = f"{pending / free:.1f}x" if free else "no idle"
+    return f"{pending} ({ratio})"
+
+# tres_alloc_pattern regex has 3 groups, for tres strings like
+# "cpu=16,mem=64G,node=1,billing=16,gres/gpu=2":
+# 1. the resource name, 2. the number and 3. the (optional) memory unit
+tres_alloc_pattern = re.compile(r"(?:^|,)(cpu|mem|gres/gpu)=(\d+(?:\.\d+)?)([MGT]?)")
+
+def aggregate_usage_by_user(squeue_output: str) -> dict:
+    """
+    Takes the output of QOS_RUNNING_FLAGS (with the -q list added) and sums the
+    allocated cpu, mem (in MB) and gpus of running jobs, in a single pass:
+    { "uwit-gpu-a40" : { "alice" : { "cpu" : 16, "mem" : 65536, "gpu" : 2 } } }
+    """
+    usage_by_user = defaultdict(lambda: defaultdict(lambda: {"cpu": 0, "mem": 0, "gpu": 0}))
+    for line in io.StringIO(squeue_output):
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        user, qos_name, tres_alloc = fields[:3]
+        user_usage = usage_by_user[qos_name][user]
+        for resource, amount, unit in re.findall(tres_alloc_pattern, tres_alloc):
+            if resource == "mem":
+                user_usage["mem"] += int(float(amount) * MEM_UNITS_IN_MB[unit])
+            else:
+                user_usage[resource.removeprefix("gres/")] += int(amount)
+    return usage_by_user
+
+def split_qos_name(qos_name: str) -> tuple:
+    """
+    Takes a qos name and returns its (account, partition), e.g.
+    "uwit" -> ("uwit", "compute"), "uwit-bigmem" -> ("uwit", "compute-bigmem")
+    and "uwit-gpu-a40" -> ("uwit", "gpu-a40")
+    """
+    if "-" in qos_name:
+        account, qos_suffix = qos_name.split('-', 1)
+        if qos_suffix.endswith("mem"):
+            return account, f"compute-{qos_suffix}"
+        return account, qos_suffix
+    return qos_name, "compute"
+
+def parse_grptres(scontrol_output: str) -> dict:
+    """
+    Takes the output of `scontrol show assoc_mgr flags=qos qos=...` and returns
+    the GrpTRES limits as a dictionary, e.g.:
+    { "cpu" : { "total" : 40, "used" : 8, "free" : 32 }, ... }
+    Raises LookupError if there's no GrpTRES line in the output.
+    """
+    grptres_line = re.search(QosResource.grptres_pattern, scontrol_output)
+    if not grptres_line:
+        raise LookupError("No GrpTRES line in scontrol output.")
+    resource_data = {}
+    resource_list = re.findall(QosResource.resource_pattern, grptres_line[1])
+    for item in resource_list:
+        total = int(item[1].replace('N', '0'))
+        used = int(item[2])
+        free = total - used
+        resource_data[item[0]] = { "total" : total,
+                                   "used"  : used,
+                                   "free"  : free }
+    return resource_data
+
+def filter_qos_by_cluster(sacctmgr_output: str, cluster: str) -> list:
+    """
+    The input here is a multiline string with lines that look like:
+        cluster|uwit,uwit-bigmem,uwit-gpu-2080ti
+        klone|uwit,uwit-bigmem,uwit-gpu-2080ti
+    So here's the process.
+        1. Create a list from the lines of the string when:
+            a. the line begins with the cluster we query for ("klone")
+        2. Remove the prefix and pipe (so, "klone|")
+        4. Join the separate lines with a comma.
+        5. Split all elemenets (by comma) into a new list.
+    """
+    qos_list_by_cluster = ','.join(
+        [ qos_line.removeprefix(cluster + "|")
+            for qos_line in sacctmgr_output.split()
+            if qos_line.startswith(cluster + "|")]
+        ).split(',')
+    return qos_list_by_cluster
+
+def parse_ckpt_sinfo(sinfo_output: str, task_gpu_count: int, excluded_nodes=None) -> tuple:
+    """
+    Takes the output of CKPT_SINFO_FLAGS and returns a tuple of
+    (free cpus, free gpus by type, total gpus by type, gpu tasks by type),
+    where gpu tasks counts how many task_gpu_count-sized tasks fit on nodes.
+    Nodes in excluded_nodes (e.g. reserved for maintenance) still count toward
+    the totals, but not toward free cpus, free gpus or gpu tasks.
+    """
+    free_cpu = defaultdict(int)
+    all_gpu = defaultdict(int)
+    free_gpu = defaultdict(int)
+    gpu_tasks = defaultdict(int)
+
+    for line in sinfo_output.split('\n'):
+        has_resources = re.match(sinfo_pattern, line)
+        if has_resources:
+            nodes_num, avail_cpu, gpu_type, total_gpu, used_gpu = has_resources.groups()
+            if total_gpu and used_gpu:
+                total_gpu = int(total_gpu)
+                used_gpu = int(used_gpu)
+                nodes_num = int(nodes_num)
+                usable_nodes_num = nodes_num
+                if excluded_nodes:
+                    line_nodes = expand_hostlist(line.split()[-1])
+                    usable_nodes_num -= sum(node in excluded_nodes for node in line_nodes)
+                avail_gpu = total_gpu - used_gpu
+                if int(avail_cpu) == 0:
+                    avail_gpu = 0
+                free_gpu[gpu_type] += avail_gpu * usable_nodes_num
+                all_gpu[gpu_type] += total_gpu * nodes_num
+                if task_gpu_count and avail_gpu >= task_gpu_count:
+                    gpu_tasks[gpu_type] += (avail_gpu // task_gpu_count) * usable_nodes_num
+                if usable_nodes_num < nodes_num:
+                    avail_cpu = int(avail_cpu) * usable_nodes_num // nodes_num
+
+            free_cpu[gpu_type] = int(avail_cpu)
+
+    return sum(free_cpu.values()), dict(free_gpu), dict(all_gpu), dict(gpu_tasks)
 
 class QosResource:
     """
     The QosResource class performs an scontrol query for the QOS name given
     on instantiation. The data that gets generated on instantiation is:
     string: account, string: partition, dictionary: resource_data.
+    If scontrol didn't answer in time, resource_data comes from the cache and
+    stale_note says so, or it's left empty and unavailable is set.
     """
     # resource_pattern regex has 3 groups:
     # a word and two numbers in the format "word=numbers(numbers)"
@@ -27,33 +201,24 @@ class QosResource:
     # 1. a line starting with "   GrpTRES=" and 2. the rest of that line
     grptres_pattern = re.compile(r"(?:\s*GrpTRES=)(.*)")
 
-    def __init__(self, qos_name: str):
+    def __init__(self, qos_name: str, commands_left: int = 1):
         self.qos_name = qos_name
-        if "-" in self.qos_name:
-            self.account, qos_suffix = self.qos_name.split('-', 1)
-            if qos_suffix.endswith("mem"):
-                self.partition = f"compute-{qos_suffix}"
-            else:
-                self.partition = qos_suffix
-        else:
-            self.account = self.qos_name
-            self.partition = "compute"
+        self.commands_left = commands_left
+        self.account, self.partition = split_qos_name(self.qos_name)
         self.resource_data = {}
+        self.unavailable = False
+        self.stale_note = ""
         self.__query_qos()
 
     def __query_qos(self):
         scontrol_flags = ["scontrol", "show", "assoc_mgr", "flags=qos", "qos=" + self.qos_name]
-        scontrol_output = subprocess.run(scontrol_flags, capture_output=True,
-            encoding='utf-8', check=False).stdout
-        grptres_line = re.search(self.grptres_pattern, scontrol_output)
-        resource_list = re.findall(self.resource_pattern, grptres_line[1])
-        for item in resource_list:
-            total = int(item[1].replace('N', '0'))
-            used = int(item[2])
-            free = total - used
-            self.resource_data[item[0]] = { "total" : total,
-                                       "used"  : used,
-                                       "free"  : free }
+        try:
+            scontrol_output = run_slurm_command(scontrol_flags, commands_left=self.commands_left)
+            self.resource_data = parse_grptres(scontrol_output.stdout)
+        except (SlurmUnavailable, LookupError):
+            self.unavailable = True
+            return
+        self.stale_note = scontrol_output.stale_note()
 
 class QosResourceQuery:
     """
@@ -79,6 +244,17 @@ class QosResourceQuery:
         self.ckpt_free_gpu = ""
         self.ckpt_fairshare = ""
         self.ckpt_job_limit = ""
+        self.ckpt_free_gpu_by_type = {}
+        self.ckpt_total_gpu_by_type = {}
+        self.ckpt_fairshare_by_account = {}
+        self.ckpt_display_gpus = []
+        self.ckpt_pending_gpu = ""
+        self.qos_usage_by_user = {}
+        # Set when a section's data is cached or unavailable, for table captions
+        self.qos_note = ""
+        self.ckpt_note = ""
+        self.ckpt_excludes_reserved = False
+        self.fairshare_note = ""
         self.debug = False
         if self.query_type == "user" or self.query_type == "group":
             self.__validate_query_search_term()
@@ -118,22 +294,9 @@ class QosResourceQuery:
 
     def __filter_by_cluster(self, sacctmgr_output):
         """
-        The input here is a multiline string with lines that look like:
-            cluster|uwit,uwit-bigmem,uwit-gpu-2080ti
-            klone|uwit,uwit-bigmem,uwit-gpu-2080ti
-        So here's the process.
-            1. Create a list from the lines of the string when:
-                a. the line begins with the cluster we query for ("klone")
-            2. Remove the prefix and pipe (so, "klone|")
-            4. Join the separate lines with a comma.
-            5. Split all elemenets (by comma) into a new list.
+        Keeps the QOSes for the cluster we query for, see filter_qos_by_cluster.
         """
-        qos_list_by_cluster = ','.join(
-            [ qos_line.removeprefix(self.query_cluster + "|")
-                for qos_line in sacctmgr_output.split()
-                if qos_line.startswith(self.query_cluster + "|")]
-            ).split(',')
-        return qos_list_by_cluster
+        return filter_qos_by_cluster(sacctmgr_output, self.query_cluster)
 
     def __sacctmgr_query(self):
         """
@@ -144,9 +307,13 @@ class QosResourceQuery:
         if self.query_type == "user":
             index = sacctmgr_flags.index("user") + 1
             sacctmgr_flags.insert(index, self.query_search_term)
-        sacctmgr_output = subprocess.run(sacctmgr_flags, capture_output=True,
-            encoding='utf-8', check=False).stdout
-        qos_list_by_cluster = self.__filter_by_cluster(sacctmgr_output)
+        try:
+            sacctmgr_output = run_slurm_command(sacctmgr_flags)
+        except SlurmUnavailable as error:
+            self.qos_note = f"unavailable, {error}"
+            return []
+        self.qos_note = sacctmgr_output.stale_note()
+        qos_list_by_cluster = self.__filter_by_cluster(sacctmgr_output.stdout)
         return qos_list_by_cluster
 
     def __filter_out_ckpt(self, qos_name):
@@ -202,9 +369,10 @@ class QosResourceQuery:
         self.qos_list = self.__filter_qos_list(unfiltered_qos_list)
 
     def __generate_qos_resource_dict(self):
-        for qos_name in self.qos_list:
-            if qos_name:
-                self.qos_resource_dict[qos_name] = QosResource(qos_name)
+        qos_names = [qos_name for qos_name in self.qos_list if qos_name]
+        # Each scontrol gets an even share of the time left for the ones after it
+        for index, qos_name in enumerate(qos_names):
+            self.qos_resource_dict[qos_name] = QosResource(qos_name, len(qos_names) - index)
 
     def run_query(self):
         """
@@ -216,61 +384,59 @@ class QosResourceQuery:
         self.__generate_qos_list()
         self.__generate_qos_resource_dict()
 
-    def run_ckpt_query(self, task_gpu_count, display_full_ckpt):
+    def run_breakdown_query(self):
+        """
+        This method fetches the running jobs of every QOS in qos_resource_dict with
+        one squeue call, and breaks each QOS's usage down by user. run_query()
+        must run first.
         """
-        This method queries ckpt resources & job limit, then turns on the ckpt printing flag
+        qos_names = [qos_name for qos_name, qos_data in self.qos_resource_dict.items()
+                     if not qos_data.unavailable]
+        if not qos_names:
+            return
+        squeue_flags = QOS_RUNNING_FLAGS + ["-q", ",".join(qos_names)]
+        try:
+            squeue_output = run_slurm_command(squeue_flags)
+        except SlurmUnavailable:
+            return
+        self.qos_usage_by_user = aggregate_usage_by_user(squeue_output.stdout)
+
+    def run_ckpt_query(self, task_gpu_count, display_full_ckpt, excluded_nodes=None):
+        """
+        This method queries ckpt resources & job limit, then turns on the ckpt printing flag.
+        Nodes in excluded_nodes aren't counted as idle.
         """
         self.print_ckpt = True
-        # Regex matches groups from sinfo lines like:
-        #   81/39/0/120         gpu:2080ti:8        gpu:2080ti:8(IDX:0-7
-        #   3072/10232/160/13464(null)              gpu:0
-        # and retrieves:
-        # 1. the number of nodes
-        # 2. the second column (avail cpus) of the */*/*/*,
-        # 3. the final column (total gpus) of gpu:2080ti:X
-        # 4. the final column (used gpus) of gpu:2080ti:8(IDX:0-7
-        sacctmgr_show_job_limit = [
-        "/usr/bin/sacctmgr", "show", "association", "where", "account=ckpt", "format=GrpJobs", "--noheader", "--parsable2"
-        ]
-        job_limit = subprocess.run(sacctmgr_show_job_limit, capture_output=True,
-            encoding='utf-8', check=False).stdout.strip()
+        self.ckpt_excludes_reserved = bool(excluded_nodes)
+        try:
+            job_limit = run_slurm_command(CKPT_JOB_LIMIT_FLAGS, commands_left=2).stdout.strip()
+        except SlurmUnavailable:
+            job_limit = ""
         if job_limit:
             self.ckpt_job_limit = job_limit
 
-        sinfo_pattern = re.compile(
-            r"(\d*) *\d*\/(\d*)\/\d*\/\d*(?:\(\w*\)|) *(?:gpu:(\w*):|)(\d|) *(?:gpu:\w*:|)(\d|)")
-
-        sinfo_flags = ["sinfo", "-hp", "ckpt-all", "-O", "Nodes,CPUsState,Gres,GresUsed"]
-        sinfo_output = subprocess.run(sinfo_flags, capture_output=True,
-            encoding='utf-8', check=False).stdout
-
-        free_cpu = defaultdict(int)
-        all_gpu = defaultdict(int)
-        free_gpu = defaultdict(int)
-        gpu_tasks = defaultdict(int)
-
-        for line in sinfo_output.split('\n'):
-            has_resources = re.match(sinfo_pattern, line)
-            if has_resources:
-                nodes_num, avail_cpu, gpu_type, total_gpu, used_gpu = has_resources.groups()
-                if total_gpu and used_gpu:
-                    total_gpu = int(total_gpu)
-                    used_gpu = int(used_gpu)
-                    nodes_num = int(nodes_num)
-                    avail_gpu = total_gpu - used_gpu
-                    if int(avail_cpu) == 0:
-                        avail_gpu = 0
-                    free_gpu[gpu_type] += avail_gpu * nodes_num
-                    all_gpu[gpu_type] += total_gpu * nodes_num
-                    if task_gpu_count and avail_gpu >= task_gpu_count:
-                        gpu_tasks[gpu_type] += (avail_gpu // task_gpu_count) * nodes_num
-
-                free_cpu[gpu_type] = int(avail_cpu)
-
-        self.ckpt_free_cpu = str(sum(free_cpu.values()))
+        try:
+            sinfo_output = run_slurm_command(CKPT_SINFO_FLAGS)
+        except SlurmUnavailable as error:
+            self.ckpt_note = f"unavailable, {error}"
+            self.ckpt_free_cpu = "-"
+            self.ckpt_free_gpu = "-"
+            return
+        self.ckpt_note = sinfo_output.stale_note()
+
+        total_free_cpu, free_gpu, all_gpu, gpu_tasks = parse_ckpt_sinfo(
+            sinfo_output.stdout, task_gpu_count, excluded_nodes)
+        free_gpu = defaultdict(int, free_gpu)
+        all_gpu = defaultdict(int, all_gpu)
+        gpu_tasks = defaultdict(int, gpu_tasks)
+
+        self.ckpt_free_cpu = str(total_free_cpu)
+        self.ckpt_free_gpu_by_type = dict(free_gpu)
+        self.ckpt_total_gpu_by_type = dict(all_gpu)
         gpus = sorted(sorted(free_gpu.keys()), key=lambda x: x in FAVORABLE_GPUS)
 
         display_gpus = [gpu for gpu in gpus if gpu in FAVORABLE_GPUS or display_full_ckpt]
+        self.ckpt_display_gpus = display_gpus
         self.ckpt_free_gpu = "\n".join(
             [
                 f"{gpu}: {f'({gpu_tasks[gpu]}) ' if task_gpu_count else ''}{free_gpu[gpu]}/{all_gpu[gpu]}"
@@ -284,14 +450,46 @@ class QosResourceQuery:
         self.ckpt_free_gpu += "\n" + \
             f"all: {f'({total_gpu_tasks}) ' if task_gpu_count else ''}{total_free_gpu}/{total_all_gpu}"
 
+    def run_ckpt_contention_query(self):
+        """
+        This method aggregates the GPUs requested by pending ckpt jobs, and lines
+        them up against the idle GPUs from run_ckpt_query(), which must run first.
+        """
+        if self.ckpt_free_gpu == "-":
+            self.ckpt_pending_gpu = "-"
+            return
+        # Every pending job is one line, so it's streamed rather than buffered & cached
+        try:
+            pending_gpu = aggregate_pending_gpus(stream_slurm_command(CKPT_PENDING_FLAGS))
+        except SlurmUnavailable:
+            self.ckpt_pending_gpu = "-"
+            return
+        pending_lines = [format_contention(pending_gpu.get(gpu, 0), self.ckpt_free_gpu_by_type.get(gpu, 0))
+                         for gpu in self.ckpt_display_gpus]
+        total_pending = sum(c for gpu, c in pending_gpu.items() if gpu in self.ckpt_display_gpus)
+        total_pending += pending_gpu.get("any", 0)
+        total_free = sum(c for gpu, c in self.ckpt_free_gpu_by_type.items() if gpu in self.ckpt_display_gpus)
+        pending_lines.append(format_contention(total_pending, total_free))
+        self.ckpt_pending_gpu = "\n".join(pending_lines)
+
     def run_fairshare_query(self, query_user):
         self.print_ckpt_fairshare = True
         fairshare_command = f"sshare -u {query_user} | grep {query_user} | grep ckpt | sort -k7,7rn | awk '{{print $1\":\", $7}}' | sed 's/-ckpt//g'"
-        fairshare_result = subprocess.run(
-            fairshare_command, shell=True, capture_output=True, text=True
-        ).stdout.strip()
+        try:
+            fairshare_output = run_slurm_command(fairshare_command, shell=True)
+        except SlurmUnavailable as error:
+            self.fairshare_note = f"unavailable, {error}"
+            return
+        self.fairshare_note = fairshare_output.stale_note()
+        fairshare_result = fairshare_output.stdout.strip()
 
         self.ckpt_fairshare += fairshare_result
+        for fairshare_line in fairshare_result.splitlines():
+            account, _, fairshare_value = fairshare_line.partition(":")
+            try:
+                self.ckpt_fairshare_by_account[account] = float(fairshare_value)
+            except ValueError:
+                continue
 
     def filter_by_partition(self, _query_partition: str):
         """
@@ -319,11 +517,22 @@ class QosResourceQuery:
         table.add_column("", justify="right")
         table.add_column("CPUs", justify="right")
         table.add_column("GPUs", justify="right")
-        table.add_row("Idle:", self.ckpt_free_cpu, self.ckpt_free_gpu)
+        if self.ckpt_pending_gpu:
+            table.add_column("Pending GPUs", justify="right")
+            table.add_row("Idle:", self.ckpt_free_cpu, self.ckpt_free_gpu, self.ckpt_pending_gpu)
+        else:
+            table.add_row("Idle:", self.ckpt_free_cpu, self.ckpt_free_gpu)
+        captions = []
         if self.ckpt_job_limit:
-            table.caption = f"Checkpoint is currently limited to {self.ckpt_job_limit} jobs"
+            captions.append(f"Checkpoint is currently limited to {self.ckpt_job_limit} jobs")
+        if self.ckpt_excludes_reserved:
+            captions.append("Excluding nodes reserved before your walltime ends")
+        if self.ckpt_note:
+            captions.append(f"({self.ckpt_note})")
+        if captions:
+            table.caption = "\n".join(captions)
             table.caption_style = "bgcolor default"
-            table.width = len(table.caption) + 6
+            table.width = max(map(len, captions)) + 6
         if table.rows:
             console = Console()
             console.print(table)
@@ -345,15 +554,29 @@ class QosResourceQuery:
         elif self.query_type == "all":
             table_title = "All accounts & available resources"
         table = Table(title=table_title, box=box.ROUNDED)
+        captions = []
         if self.partition_filter:
-            table.caption = "Filtered by partition: %s" % self.query_partition
+            captions.append("Filtered by partition: %s" % self.query_partition)
+        # sacctmgr & scontrol output cached at the same time share one note
+        notes = sorted({qos_data.stale_note for qos_data in self.qos_resource_dict.values()
+                        if qos_data.stale_note} - {self.qos_note})
+        if self.qos_note:
+            notes.insert(0, self.qos_note)
+        if notes:
+            captions.append("(%s)" % ", ".join(notes))
+        if captions:
+            table.caption = "\n".join(captions)
             table.caption_style = "bgcolor default"
         table.add_column("Account", justify="right")
         table.add_column("Partition", justify="right")
         table.add_column("CPUs", justify="right")
         table.add_column("Memory", justify="right")
         table.add_column("GPUs", justify="right")
-        for qos_data in self.qos_resource_dict.values():
+        for qos_name, qos_data in self.qos_resource_dict.items():
+            if qos_data.unavailable:
+                table.add_row(qos_data.account, qos_data.partition,
+                              "-", "-", "-", "unavailable", end_section=True)
+                continue
             table.add_row(qos_data.account,
                           qos_data.partition,
                           str(qos_data.resource_data["cpu"]["total"]),
@@ -369,12 +592,16 @@ class QosResourceQuery:
                           str(qos_data.resource_data["cpu"]["free"]),
                           str(int(qos_data.resource_data["mem"]["free"]/1024))+"G",
                           str(qos_data.resource_data["gpu"]["free"]),
-                          "FREE", end_section=True )
+                          "FREE", end_section=qos_name not in self.qos_usage_by_user )
+            if qos_name in self.qos_usage_by_user:
+                self.__add_breakdown_rows(table, self.qos_usage_by_user[qos_name])
         if table.rows:
             console = Console()
             console.print(table)
         else:
             err = [ self.query_type, "'%s'" % self.query_search_term ]
+            if self.qos_note:
+                err.append("(%s)" % self.qos_note)
             if self.query_partition:
                 err.append("and partition")
                 err.append("'%s'" % self.query_partition)
@@ -383,11 +610,27 @@ class QosResourceQuery:
             else:
                 print("Error: No data for %s" % ' '.join(err))
 
+    def __add_breakdown_rows(self, table, usage_by_user):
+        """
+        This method adds a row per user under a QOS, heaviest GPU users first.
+        """
+        users = sorted(usage_by_user.items(), reverse=True,
+                       key=lambda item: (item[1]["gpu"], item[1]["cpu"], item[1]["mem"]))
+        for index, (user, usage) in enumerate(users):
+            table.add_row("", user,
+                          str(usage["cpu"]),
+                          str(int(usage["mem"]/1024))+"G",
+                          str(usage["gpu"]),
+                          "", end_section=index == len(users) - 1 )
+
     def __print_ckpt_fairshare_table(self):
         table_title = "Fairshare on Checkpoint Resources (higher is better)"
         table = Table(title=table_title, box=box.ROUNDED)
         table.add_column("Fairshare", justify="right")
         table.add_row(self.ckpt_fairshare)
+        if self.fairshare_note:
+            table.caption = "(%s)" % self.fairshare_note
+            table.caption_style = "bgcolor default"
         if table.rows:
             console = Console()
             console.print(table)
@@ -0,0 +1,220 @@
+"""
+hyakslurm runs Slurm commands for hyakalloc under one shared latency budget.
+
+Every command gets a timeout carved out of what's left of the budget, split
+across the commands still to run. A command that times out isn't retried,
+but quick controller communication errors are, with jittered backoff, in
+whatever's left of that command's timeout. Successful output is cached on disk, so when
+a command can't finish before the deadline its last good output is returned
+instead, marked stale. If there's nothing cached either, SlurmUnavailable is
+raised.
+
+It also holds the small parsers for Slurm's hostlist and gres formats that
+the other hyakalloc modules share.
+"""
+from typing import NamedTuple, Optional
+import hashlib
+import json
+import pathlib
+import random
+import re
+import subprocess
+import threading
+import time
+
+DEFAULT_TIMEOUT = 10.0
+ATTEMPTS = 3
+BACKOFF_BASE = 0.2
+# By default no single command may use more than this fraction of the budget
+MAX_COMMAND_SHARE = 0.5
+CACHE_PATH = pathlib.Path.home() / ".cache" / "hyakalloc"
+
+# transient_error_pattern regex matches the Slurm errors that are worth
+# retrying, like "Socket timed out on send/recv operation" or "Unable to
+# contact slurm controller (connect failure)"
+transient_error_pattern = re.compile(r"timed out|connect|contact|standby|try again", re.IGNORECASE)
+
+# hostlist_pattern regex has 2 groups, for hostlists like "g[3001-3003,3010],z3001":
+# 1. the host prefix and 2. the (optional) bracketed ranges
+hostlist_pattern = re.compile(r"([^,\[]+)(?:\[([^\]]*)\])?")
+# gpu_pattern regex has 2 groups, for gres strings like "gpu:a40:8(S:0-1)",
+# "gres/gpu:a40:4" or "gres/gpu:4": 1. the (optional) gpu type and 2. the count
+gpu_pattern = re.compile(r"gpu:(?:([a-zA-Z]\w*):)?(\d+)")
+
+def expand_hostlist(hostlist: str) -> list:
+    """
+    Expands a compressed Slurm hostlist, e.g. "g[3001-3002],z3001" into
+    ["g3001", "g3002", "z3001"].
+    """
+    hosts = []
+    for prefix, ranges in re.findall(hostlist_pattern, hostlist):
+        if not ranges:
+            hosts.append(prefix)
+            continue
+        for host_range in ranges.split(','):
+            start, _, end = host_range.partition('-')
+            for number in range(int(start), int(end or start) + 1):
+                hosts.append(f"{prefix}{number:0{len(start)}d}")
+    return hosts
+
+def parse_gpu_request(gpu_request: str) -> tuple:
+    """
+    Takes a "type:count" string like "a40:4" and returns ("a40", 4). The count
+    defaults to 1 when it's left off.
+    """
+    gpu_type, _, gpu_count = gpu_request.partition(':')
+    if not gpu_type or (gpu_count and not gpu_count.isdigit()):
+        raise ValueError("GPU request should look like 'a40:4'")
+    return gpu_type, int(gpu_count or 1)
+
+_budget = DEFAULT_TIMEOUT
+_deadline = time.monotonic() + DEFAULT_TIMEOUT
+_command_share = MAX_COMMAND_SHARE
+# Set once any command couldn't finish in time, so callers know to refresh
+_fell_back = False
+
+class SlurmUnavailable(RuntimeError):
+    """
+    Raised when a Slurm command didn't succeed before the deadline and has
+    no cached output to fall back on.
+    """
+
+class SlurmOutput(NamedTuple):
+    stdout: str
+    cached_at: Optional[float]  # time.time() of the cached output, None if fresh
+
+    @property
+    def stale(self) -> bool:
+        return self.cached_at is not None
+
+    def stale_note(self) -> str:
+        """
+        Returns e.g. "cached data from 02:15PM" for stale output, else "".
+        """
+        if not self.stale:
+            return ""
+        return "cached data from " + time.strftime('%I:%M%p', time.localtime(self.cached_at))
+
+def set_timeout(seconds: float, command_share: float = MAX_COMMAND_SHARE) -> None:
+    """
+    Starts the shared latency budget: every command run from now on has to
+    finish within seconds of this call, and no single command may use more
+    than command_share of it.
+    """
+    global _budget, _deadline, _command_share
+    _budget = seconds
+    _deadline = time.monotonic() + seconds
+    _command_share = command_share
+
+def remaining_time() -> float:
+    return max(_deadline - time.monotonic(), 0.0)
+
+def fell_back() -> bool:
+    """
+    Returns whether any command so far fell back to the cache (or found no
+    cache) because it didn't finish in time.
+    """
+    return _fell_back
+
+def _cache_file(command) -> pathlib.Path:
+    command_key = json.dumps(command)
+    return CACHE_PATH / (hashlib.sha1(command_key.encode('utf-8')).hexdigest() + ".json")
+
+def write_cache(command, stdout: str) -> None:
+    try:
+        CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        cache_file = _cache_file(command)
+        temporary_file = cache_file.with_suffix(".tmp")
+        temporary_file.write_text(json.dumps({"time": time.time(), "stdout": stdout}), encoding='utf-8')
+        temporary_file.replace(cache_file)
+    except OSError:
+        pass
+
+def read_cache(command, max_age: float = None) -> Optional[SlurmOutput]:
+    """
+    Returns the cached output for command, or None if there isn't any (or if
+    it's older than max_age seconds, or claims to be from the future).
+    """
+    try:
+        cached = json.loads(_cache_file(command).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    if max_age is not None and not 0 <= time.time() - cached["time"] <= max_age:
+        return None
+    return SlurmOutput(cached["stdout"], cached["time"])
+
+def run_slurm_command(command, shell: bool = False, timeout: float = None,
+                      commands_left: int = 1) -> SlurmOutput:
+    """
+    Runs command (a list of flags, or a string if shell is True) within its
+    share of the remaining budget: an even split across the commands_left
+    still to run in a row (this one included), capped at the command share.
+    Quick transient errors are retried in what's left of that share, but a
+    timeout isn't, since a slow Slurm won't be faster the second time. Falls
+    back to cached output on timeout, and raises SlurmUnavailable if there is
+    none. A command that fails for any other reason (e.g. an unknown user)
+    raises SlurmUnavailable right away, since old output would hide it.
+    If timeout is given, the command gets that many seconds instead, and the
+    shared budget is left alone.
+    """
+    if timeout is None:
+        timeout = min(remaining_time() / max(commands_left, 1), _budget * _command_share)
+    give_up_at = time.monotonic() + timeout
+    command_name = command.split()[0] if shell else command[0]
+    for attempt in range(ATTEMPTS):
+        if attempt:
+            backoff = random.uniform(0, BACKOFF_BASE * 2 ** (attempt - 1))
+            time.sleep(min(backoff, max(give_up_at - time.monotonic(), 0.0)))
+        attempt_timeout = give_up_at - time.monotonic()
+        if attempt_timeout <= 0:
+            break
+        try:
+            result = subprocess.run(command, shell=shell, capture_output=True,
+                encoding='utf-8', check=False, timeout=attempt_timeout)
+        except (subprocess.TimeoutExpired, OSError):
+            break
+        if result.returncode == 0:
+            write_cache(command, result.stdout)
+            return SlurmOutput(result.stdout, None)
+        if not re.search(transient_error_pattern, result.stderr):
+            error_lines = result.stderr.strip().splitlines()
+            error_message = error_lines[0] if error_lines else f"exit status {result.returncode}"
+            raise SlurmUnavailable(f"'{command_name}' failed: {error_message}")
+
+    global _fell_back
+    _fell_back = True
+    cached_output = read_cache(command)
+    if cached_output is None:
+        raise SlurmUnavailable(f"'{command_name}' didn't respond in time")
+    return cached_output
+
+def stream_slurm_command(command):
+    """
+    Runs command (a list of flags) within the remaining budget and yields its
+    stdout one line at a time, for output too big to buffer or cache, like
+    every pending job. Nothing is retried or cached: SlurmUnavailable is
+    raised if the command fails or doesn't finish before the deadline.
+    """
+    command_timeout = min(remaining_time(), _budget * _command_share)
+    if command_timeout <= 0:
+        raise SlurmUnavailable(f"'{command[0]}' didn't respond in time")
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   encoding='utf-8')
+    except OSError as error:
+        raise SlurmUnavailable(f"'{command[0]}' couldn't run") from error
+    kill_timer = threading.Timer(command_timeout, process.kill)
+    kill_timer.start()
+    try:
+        yield from process.stdout
+        returncode = process.wait()
+    finally:
+        kill_timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+    if returncode < 0:
+        raise SlurmUnavailable(f"'{command[0]}' didn't respond in time")
+    if returncode != 0:
+        raise SlurmUnavailable(f"'{command[0]}' failed")
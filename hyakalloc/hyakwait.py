@@ -0,0 +1,144 @@
+"""
+Wait until a ckpt node has the requested GPUs (and CPUs) free
+"""
+from datetime import datetime, timedelta
+import random
+import re
+import time
+from hyakalloc import hyakslurm
+from hyakalloc.hyakmxcheck import HyakMxCheck
+from hyakalloc.hyakslurm import gpu_pattern, parse_gpu_request
+
+WAIT_SINFO_FLAGS = ["sinfo", "-hNp", "ckpt-all", "-t", "idle,mix", "-O",
+                    "NodeHost:50,CPUsState:30,Gres:100,GresUsed:100"]
+FIRST_INTERVAL = 15
+# sinfo output younger than this (from any of the user's waiting hyakallocs)
+# is reused. It's longer than the first polling interval, so even a lone
+# waiter only runs sinfo every other check to begin with.
+FRESH_SECONDS = 2 * FIRST_INTERVAL
+MAX_INTERVAL = 300
+BACKOFF_FACTOR = 1.5
+CHECK_TIMEOUT = 10
+
+# duration_pattern regex has 3 groups, for durations like "2h", "1h30m" or "90s":
+# 1. hours, 2. minutes and 3. seconds
+duration_pattern = re.compile(r"(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?")
+
+def parse_wait_request(wait_request: str) -> tuple:
+    """
+    Takes a string like "a40:4" or "a40:4,cpus=32" and returns
+    (gpu type, gpu count, cpus).
+    """
+    gpu_request, *extras = wait_request.split(',')
+    gpu_type, gpu_count = parse_gpu_request(gpu_request)
+    cpus = 0
+    for extra in extras:
+        key, _, value = extra.partition('=')
+        if key != "cpus" or not value.isdigit():
+            raise ValueError(f"Can't parse '{extra}', expected cpus=N")
+        cpus = int(value)
+    return gpu_type, gpu_count, cpus
+
+def parse_duration(duration: str) -> int:
+    """
+    Takes a duration like "2h", "1h30m", "90s", or a Slurm time like "45"
+    (minutes), "HH:MM:SS" or "D-HH:MM:SS", and returns it in seconds.
+    """
+    if duration.isdigit():
+        return int(duration) * 60
+    if ':' in duration or '-' in duration:
+        days, _, clock = duration.rpartition('-')
+        clock_parts = clock.split(':')
+        if (days and not days.isdigit()) or not all(part.isdigit() for part in clock_parts):
+            raise ValueError(f"Can't parse duration '{duration}'")
+        if days and len(clock_parts) == 1:
+            # Slurm reads "D-HH" as days & hours
+            clock_parts.append("0")
+        seconds = 0
+        for part in clock_parts:
+            seconds = seconds * 60 + int(part)
+        if days and len(clock_parts) == 2:
+            # Slurm reads "D-HH:MM" as days, hours & minutes
+            seconds *= 60
+        return int(days or 0) * 86400 + seconds
+    duration_match = re.fullmatch(duration_pattern, duration)
+    if not duration or not duration_match:
+        raise ValueError(f"Can't parse duration '{duration}', try e.g. 2h or 1h30m")
+    hours, minutes, seconds = (int(group or 0) for group in duration_match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+class HyakCapacityWait:
+    """
+    Checks ckpt-all for a single node with gpu_count free GPUs of gpu_type (and
+    cpus idle CPUs), using the per-node sinfo query only, and reusing sinfo
+    output from the user's hyakslurm cache if it's younger than FRESH_SECONDS.
+    Each sinfo run gets its own CHECK_TIMEOUT, apart from hyakalloc's --timeout.
+    If walltime (in seconds) is given, nodes reserved (e.g. for maintenance)
+    before a job of that walltime started now would end are skipped.
+
+    Provides two public methods:
+
+    1. check(), which returns the name of a matching node, or None.
+
+    2. wait(max_wait), which keeps checking with jittered, growing intervals and
+    returns the name of a matching node, or None after max_wait seconds.
+    """
+    def __init__(self, gpu_type: str, gpu_count: int, cpus: int = 0, walltime: int = None) -> None:
+        self.gpu_type = gpu_type
+        self.gpu_count = gpu_count
+        self.cpus = cpus
+        self.walltime = walltime
+        # Reservations are looked up once, the walltime window moves with each check
+        self.maintenance = HyakMxCheck() if walltime else None
+
+    def __sinfo_run(self):
+        cached_output = hyakslurm.read_cache(WAIT_SINFO_FLAGS, max_age=FRESH_SECONDS)
+        if cached_output is not None:
+            return cached_output.stdout
+        try:
+            sinfo_output = hyakslurm.run_slurm_command(WAIT_SINFO_FLAGS, timeout=CHECK_TIMEOUT)
+        except hyakslurm.SlurmUnavailable:
+            return ""
+        # Stale output can't prove there's capacity right now
+        return "" if sinfo_output.stale else sinfo_output.stdout
+
+    def check(self):
+        """
+        Returns the name of a node that fits the request right now, or None.
+        """
+        excluded_nodes = set()
+        if self.walltime:
+            excluded_nodes = self.maintenance.reserved_nodes(datetime.now() + timedelta(seconds=self.walltime))
+        for line in self.__sinfo_run().splitlines():
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            node_name, cpus_state, gres, gres_used = fields[:4]
+            if node_name in excluded_nodes:
+                continue
+            total_gpu = re.search(gpu_pattern, gres)
+            if not total_gpu or total_gpu[1] != self.gpu_type:
+                continue
+            used_gpu = re.search(gpu_pattern, gres_used)
+            free_gpu = int(total_gpu[2]) - (int(used_gpu[2]) if used_gpu else 0)
+            idle_cpu = int(cpus_state.split('/')[1])
+            if free_gpu >= self.gpu_count and idle_cpu >= max(self.cpus, 1):
+                return node_name
+        return None
+
+    def wait(self, max_wait: int):
+        """
+        Checks until a node fits or max_wait seconds pass. Returns the node name,
+        or None if it timed out.
+        """
+        give_up_at = time.monotonic() + max_wait
+        interval = FIRST_INTERVAL
+        while True:
+            node_name = self.check()
+            if node_name:
+                return node_name
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(random.uniform(0.5, 1.0) * interval, remaining))
+            interval = min(interval * BACKOFF_FACTOR, MAX_INTERVAL)
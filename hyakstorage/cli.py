@@ -4,23 +4,32 @@ shared directories (contrib/gscratch). Options are:
 -
 """
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import NamedTuple
 from dataclasses import dataclass
 import argparse
 import getpass
 import pathlib
 import csv
+import json
+import sys
 import grp
 import pwd
-import rich, rich.box, rich.table, rich.console
+import time
+import functools
 
 CSV_FILENAME=".hyakstorage.csv"
+HISTORY_PATH=pathlib.Path.home() / ".cache" / "hyakstorage" / "usage_history.csv"
+REPORT_CACHE_PATH=pathlib.Path.home() / ".cache" / "hyakstorage" / "report_tables.json"
+SECONDS_PER_DAY=86400
+SWEEP_WORKERS=32
+SWEEP_TOP_CONSUMERS=3
 
 def parse_arguments() -> argparse.Namespace:
     """
     Input: None
     Returns: argparse.Namespace object ("parsed" arguments):
-        search_for: string (can be path or group name)
+        search_for: list of strings (each can be a path or group name)
 
         print_my_homedir: bool (default False)
         print_my_gscratch_dirs: bool (default False)
@@ -31,6 +40,16 @@ def parse_arguments() -> argparse.Namespace:
 
         sort_by_disk: bool (default False but True if no other sort selected)
         sort_by_files: bool (default False)
+
+        who_user: string (default '', report a user's usage across all filesets)
+        who_group: string (default '', report a group's usage across all filesets)
+
+        record_history: bool (default False)
+        forecast: bool (default False)
+
+        sweep: bool (default False)
+        threshold: float (default 0.9)
+        output_format: string (table|json|csv, default table)
     """
     parser = argparse.ArgumentParser(prog="hyakstorage")
     selection_arguments = parser.add_argument_group('selection options')
@@ -66,12 +85,43 @@ def parse_arguments() -> argparse.Namespace:
         )
     search_arguments = parser.add_argument_group('search option')
     search_arguments.add_argument(
-        "search_for", nargs='?', type=str, default='', metavar='path or groupname',
-        help="show usage for this path or group"
+        "search_for", nargs='*', type=str, default=[], metavar='path or groupname',
+        help="show usage for these paths or groups"
+        )
+    search_arguments.add_argument(
+        "--who", type=str, default='', dest='who_user', metavar='USER',
+        help="show a user's usage across all gscratch and contrib filesets"
+        )
+    search_arguments.add_argument(
+        "--who-group", type=str, default='', dest='who_group', metavar='GROUP',
+        help="show a group's usage across all gscratch and contrib filesets"
+        )
+    history_arguments = parser.add_argument_group('history options')
+    history_arguments.add_argument(
+        "--record-history", action='store_true', dest='record_history',
+        help=f"append current usage of my filesets to {HISTORY_PATH}"
+        )
+    history_arguments.add_argument(
+        "--forecast", action='store_true', dest='forecast',
+        help="estimate days until my filesets hit their disk and files quotas, "
+             "and my growth rate in each (every user's with -u)"
+        )
+    sweep_arguments = parser.add_argument_group('admin options')
+    sweep_arguments.add_argument(
+        "--sweep", action='store_true', dest='sweep',
+        help="scan every home, gscratch and contrib fileset for quota pressure"
+        )
+    sweep_arguments.add_argument(
+        "--threshold", type=float, default=0.9, dest='threshold',
+        help="fraction of disk or files quota to report in --sweep (default 0.9)"
+        )
+    parser.add_argument(
+        "--format", choices=("table", "json", "csv"), default="table", dest='output_format',
+        help="output format (default table)"
         )
 
     # Additional argument validation:
-    _args = parser.parse_args()
+    _args = parser.parse_intermixed_args()
 
     # If the user didn't sort by files, we should sort by disk
     if not _args.sort_by_files:
@@ -87,11 +137,30 @@ def parse_arguments() -> argparse.Namespace:
     if user_selected_folders and user_provided_search_term:
         parser.error("folder selection and searching are mutually exclusive")
 
+    # Cross-fileset queries replace both folder selection and searching
+    user_provided_who_query = bool(_args.who_user or _args.who_group)
+    if user_provided_who_query and (user_selected_folders or user_provided_search_term):
+        parser.error("--who/--who-group can't be combined with folder selection or searching")
+
+    # History modes always cover every fileset the user can see
+    user_selected_history_mode = _args.record_history or _args.forecast
+    if user_selected_history_mode and (user_provided_search_term or user_provided_who_query):
+        parser.error("--record-history/--forecast can't be combined with searching")
+
+    # Sweeping covers every fileset, so it can't be narrowed down
+    if _args.sweep and any((user_selected_folders, user_provided_search_term,
+                            user_provided_who_query, user_selected_history_mode)):
+        parser.error("--sweep can't be combined with other selection or search options")
+
+    # Machine-readable output is built from the usage reports & sweep only
+    if _args.output_format != "table" and (user_provided_who_query or user_selected_history_mode):
+        parser.error("--format is only supported for usage reports and --sweep")
+
     # If user didn't pick any folders, show homedir and gscratch dirs
     if not user_selected_folders:
         parser.set_defaults(print_my_homedir=True, print_my_gscratch_dirs=True)
 
-    return parser.parse_args()
+    return parser.parse_intermixed_args()
 class UsageCSVDataFields(NamedTuple):
     disk_used: int
     disk_quota: int
@@ -125,16 +194,27 @@ class UsageReportTable(NamedTuple):
     rows: list[UsageReportRow]
 
 
-def parse_usage_csv(path_to_report: pathlib.Path) -> dict:
+def parse_usage_csv(path_to_report: pathlib.Path, only_user: str = None, fileset_only: bool = False) -> dict:
+    """
+    Parses a usage csv into { "fileset": data, "user": {...}, "group": {...} }.
+    If only_user is given (or fileset_only is set), every other user/group row
+    is skipped unconverted and reading stops as soon as the fileset line and
+    that user's line are found.
+    """
+    lazy = fileset_only or only_user is not None
     parsed_csv = defaultdict(dict)
     parsed_csv["path"] = path_to_report
     with path_to_report.open(mode="r", encoding="utf-8", newline="") as csvfile:
         for line in csv.reader(csvfile):
+            if lazy and line[1] != "fileset" and (line[1] != "user" or line[0] != only_user):
+                continue
             parsed_line = UsageCSVLine(*line)
             if parsed_line.type == "fileset":
                 parsed_csv[parsed_line.type] = parsed_line.data
             else:
                 parsed_csv[parsed_line.type][parsed_line.value] = parsed_line.data
+            if lazy and parsed_csv["fileset"] and (fileset_only or only_user in parsed_csv["user"]):
+                break
     #pprint(parsed_csv)
     return parsed_csv
 
@@ -168,24 +248,28 @@ def make_totals_rows(row_title: str, csv_data_fields: UsageCSVDataFields) -> Usa
     bottom_row = UsageReportRow("", disk_percent, files_percent)
     return [top_row, bottom_row]
 
-def print_homedir_report(homedir_csv_path=None) -> None:
+def make_homedir_report_table(homedir_csv_path=None) -> UsageReportTable:
     if homedir_csv_path is None:
         my_homedir = pathlib.Path.home()
         homedir_csv_path = my_homedir / CSV_FILENAME
     if not homedir_csv_path.exists():
-        return
-    parsed_homedir_csv = parse_usage_csv(homedir_csv_path)
+        return None
     username = homedir_csv_path.parent.name
+    parsed_homedir_csv = parse_usage_csv(homedir_csv_path, only_user=username)
     usage_data_for_user = get_usage_data_for_specific_user(parsed_homedir_csv, username)
     if not usage_data_for_user:
-        return
+        return None
     homedir_totals_rows = make_totals_rows("Total:", usage_data_for_user)
     homedir_path = homedir_csv_path.parent
-    home_report = UsageReportTable(
+    return UsageReportTable(
         header = homedir_path,
         rows = homedir_totals_rows
         )
-    print_usage_table(home_report)
+
+def print_homedir_report(homedir_csv_path=None) -> None:
+    home_report = make_homedir_report_table(homedir_csv_path)
+    if home_report:
+        print_usage_table(home_report)
 
 def find_gscratch_csvs() -> list[pathlib.Path]:
     gscratch_path = pathlib.Path("/mmfs1/gscratch")
@@ -201,6 +285,24 @@ def find_gscratch_csvs() -> list[pathlib.Path]:
 
     return gscratch_csvs
 
+def find_all_contrib_csvs() -> list[pathlib.Path]:
+    contrib_path = pathlib.Path("/mmfs1/sw/contrib")
+    return list(contrib_path.glob('*-src/' + CSV_FILENAME))
+
+def find_all_homedir_csvs() -> list[pathlib.Path]:
+    gpfs_home_path = pathlib.Path("/mmfs1/home")
+    return list(gpfs_home_path.glob('*/' + CSV_FILENAME))
+
+def read_fileset_totals(path_to_report: pathlib.Path, homedir_user: str = None) -> UsageCSVDataFields:
+    """
+    Returns the fileset totals (or, for home directories, the owner's user row,
+    since that's what the home report shows), parsing the csv lazily.
+    """
+    if homedir_user:
+        parsed_csv = parse_usage_csv(path_to_report, only_user=homedir_user)
+        return get_usage_data_for_specific_user(parsed_csv, homedir_user)
+    return parse_usage_csv(path_to_report, fileset_only=True)["fileset"] or None
+
 def make_row_with_title_only(title: str) -> UsageReportRow:
     return UsageReportRow(title=title, disk_usage="", file_usage="")
 
@@ -235,8 +337,17 @@ def make_fileset_table(parsed_csv, path_to_csv_dir) -> UsageReportTable:
     return UsageReportTable(path_to_csv_dir, table_rows)
 
 
+def parse_usage_csv_for_view(csv_path: pathlib.Path, user_args: argparse.Namespace) -> dict:
+    """
+    The default view only needs the fileset totals and my own row, so the
+    full csv is only parsed when usage by user or group was asked for.
+    """
+    if user_args.show_usage_by_user or user_args.show_usage_by_group:
+        return parse_usage_csv(csv_path)
+    return parse_usage_csv(csv_path, only_user=getpass.getuser())
+
 def make_report_tables_from_csv(csv_path: pathlib.Path, user_args: argparse.Namespace) -> list[UsageReportTable]:
-    parsed_usage_csv = parse_usage_csv(csv_path)
+    parsed_usage_csv = parse_usage_csv_for_view(csv_path, user_args)
     report_tables = []
     fileset_table = make_fileset_table(parsed_usage_csv, csv_path.parent)
     report_tables.append(fileset_table)
@@ -254,7 +365,17 @@ def make_report_tables_from_csv(csv_path: pathlib.Path, user_args: argparse.Name
 
     return report_tables
 
+@functools.lru_cache(maxsize=None)
+def get_rich_console():
+    """
+    rich is only imported once a table actually gets printed, and a single
+    console is shared by every table.
+    """
+    import rich.console
+    return rich.console.Console()
+
 def print_usage_table(table_to_print: UsageReportTable) -> None:
+    import rich.box, rich.table
     if isinstance(table_to_print.header, pathlib.Path):
         table_title = f"Usage report for {table_to_print.header}"
         rich_table = rich.table.Table(title=table_title, box=rich.box.ROUNDED)
@@ -269,15 +390,47 @@ def print_usage_table(table_to_print: UsageReportTable) -> None:
     for row in table_to_print.rows:
         rich_table.add_row(*row)
     if rich_table.rows:
-        console = rich.console.Console()
-        console.print(rich_table)
+        get_rich_console().print(rich_table)
 
-def print_my_gscratch_dirs_reports(user_arguments: argparse.Namespace) -> None:
+def write_report_tables_cache(report_tables: list[UsageReportTable], cache_path: pathlib.Path = REPORT_CACHE_PATH) -> None:
+    """
+    Saves report tables (e.g. for a login banner to show when storage is slow
+    next time). Failing to write the cache is ignored.
+    """
+    cached_tables = [[str(table.header), isinstance(table.header, pathlib.Path), table.rows]
+                     for table in report_tables]
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = cache_path.with_suffix(".tmp")
+        temporary_path.write_text(json.dumps({"time": time.time(), "tables": cached_tables}), encoding="utf-8")
+        temporary_path.replace(cache_path)
+    except OSError:
+        pass
+
+def read_report_tables_cache(cache_path: pathlib.Path = REPORT_CACHE_PATH) -> tuple:
+    """
+    Returns (report tables, time.time() they were cached) from
+    write_report_tables_cache, or (None, None) if there's no usable cache.
+    """
+    try:
+        cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        report_tables = [
+            UsageReportTable(pathlib.Path(header) if is_path else header,
+                             [UsageReportRow(*row) for row in rows])
+            for header, is_path, rows in cached["tables"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+    return report_tables, cached["time"]
+
+def make_my_gscratch_dirs_report_tables(user_arguments: argparse.Namespace) -> list[UsageReportTable]:
     accessible_gscratch_csvs = find_gscratch_csvs()
     usage_report_tables = []
     for path_to_csv in accessible_gscratch_csvs:
         usage_report_tables.extend(make_report_tables_from_csv(path_to_csv, user_arguments))
-    for table in usage_report_tables:
+    return usage_report_tables
+
+def print_my_gscratch_dirs_reports(user_arguments: argparse.Namespace) -> None:
+    for table in make_my_gscratch_dirs_report_tables(user_arguments):
         print_usage_table(table)
 
 def get_my_groups() -> list[str]:
@@ -314,9 +467,7 @@ def check_if_linux_username(possible_user: str) -> bool:
         return False
 
 
-def parse_search_term_and_print_report(user_arguments: argparse.Namespace) -> None:
-    search_term = user_arguments.search_for
-
+def find_search_term_csv(search_term: str) -> pathlib.Path:
     # figure out if it's a contrib dir, linux group/user, or potentially a path
     gpfs_home_path = pathlib.Path("/mmfs1/home")
     contrib_path = pathlib.Path("/mmfs1/sw/contrib")
@@ -335,26 +486,404 @@ def parse_search_term_and_print_report(user_arguments: argparse.Namespace) -> No
         possible_csv = possible_dir
     else:
         possible_csv = possible_dir / CSV_FILENAME
+    return possible_csv
 
-    # if it's a homedir, print homedir report
-    # otherwise, try to read a usage csv and print it
-    try:
-        if possible_csv.parent.parent == gpfs_home_path:
-            print_homedir_report(possible_csv)
-        else:
-            if possible_csv.exists():
-                found_csv_tables = make_report_tables_from_csv(possible_csv, user_arguments)
-                for table in found_csv_tables:
-                    print_usage_table(table)
+def check_if_homedir_csv(csv_path: pathlib.Path) -> bool:
+    return csv_path.parent.parent == pathlib.Path("/mmfs1/home")
+
+def parse_search_term_and_print_report(user_arguments: argparse.Namespace) -> None:
+    for search_term in user_arguments.search_for:
+        possible_csv = find_search_term_csv(search_term)
+
+        # if it's a homedir, print homedir report
+        # otherwise, try to read a usage csv and print it
+        try:
+            if check_if_homedir_csv(possible_csv):
+                print_homedir_report(possible_csv)
+            else:
+                if possible_csv.exists():
+                    found_csv_tables = make_report_tables_from_csv(possible_csv, user_arguments)
+                    for table in found_csv_tables:
+                        print_usage_table(table)
+                else:
+                    print(f"error: couldn't find a storage report for '{possible_csv.parent}'")
+        except PermissionError:
+            print(f"error: can't open directory '{possible_csv.parent}'")
+
+class UsageRecord(NamedTuple):
+    path: str
+    type: str
+    name: str
+    disk_used: int
+    disk_quota: int
+    files_used: int
+    files_quota: int
+
+def make_usage_records_from_csv(csv_path: pathlib.Path, user_args: argparse.Namespace) -> list[UsageRecord]:
+    """
+    Machine-readable counterpart of make_report_tables_from_csv: the fileset
+    totals and my own row, plus every user/group row if -u/-p was given.
+    """
+    parsed_usage_csv = parse_usage_csv_for_view(csv_path, user_args)
+    fileset_path = str(csv_path.parent)
+    usage_records = []
+    if parsed_usage_csv["fileset"]:
+        usage_records.append(UsageRecord(fileset_path, "fileset", "", *parsed_usage_csv["fileset"]))
+    my_username = getpass.getuser()
+    for filter_type, show_all_rows in (("user", user_args.show_usage_by_user),
+                                       ("group", user_args.show_usage_by_group)):
+        for value, data_fields in parsed_usage_csv[filter_type].items():
+            if show_all_rows or (filter_type == "user" and value == my_username):
+                usage_records.append(UsageRecord(fileset_path, filter_type, value, *data_fields))
+    return usage_records
+
+def make_homedir_usage_records(homedir_csv_path: pathlib.Path) -> list[UsageRecord]:
+    username = homedir_csv_path.parent.name
+    parsed_homedir_csv = parse_usage_csv(homedir_csv_path, only_user=username)
+    usage_data_for_user = get_usage_data_for_specific_user(parsed_homedir_csv, username)
+    if not usage_data_for_user:
+        return []
+    return [UsageRecord(str(homedir_csv_path.parent), "user", username, *usage_data_for_user)]
+
+def find_selected_csvs(user_arguments: argparse.Namespace) -> list[pathlib.Path]:
+    if user_arguments.search_for:
+        return [find_search_term_csv(search_term) for search_term in user_arguments.search_for]
+    selected_csvs = []
+    if user_arguments.print_my_homedir:
+        selected_csvs.append(pathlib.Path.home() / CSV_FILENAME)
+    if user_arguments.print_my_gscratch_dirs:
+        selected_csvs += find_gscratch_csvs()
+    if user_arguments.print_my_contrib_dirs:
+        selected_csvs += find_my_contrib_csvs()
+    return selected_csvs
+
+def print_usage_records(user_arguments: argparse.Namespace) -> None:
+    """
+    Prints every selected or searched-for report as one JSON document or CSV
+    stream, without going through rich. Errors are written to stderr.
+    """
+    usage_records = []
+    for csv_path in find_selected_csvs(user_arguments):
+        try:
+            if not csv_path.exists():
+                if user_arguments.search_for:
+                    print(f"error: couldn't find a storage report for '{csv_path.parent}'", file=sys.stderr)
+                continue
+            if check_if_homedir_csv(csv_path):
+                usage_records.extend(make_homedir_usage_records(csv_path))
             else:
-                print(f"error: couldn't find a storage report for '{possible_csv.parent}'")
-    except PermissionError:
-        print(f"error: can't open directory '{possible_csv.parent}'")
+                usage_records.extend(make_usage_records_from_csv(csv_path, user_arguments))
+        except PermissionError:
+            print(f"error: can't open directory '{csv_path.parent}'", file=sys.stderr)
+    if user_arguments.output_format == "json":
+        json.dump([usage_record._asdict() for usage_record in usage_records], sys.stdout, indent=2)
+        print()
+    else:
+        usage_writer = csv.writer(sys.stdout)
+        usage_writer.writerow(UsageRecord._fields)
+        usage_writer.writerows(usage_records)
+
+class FilesetUsageEntry(NamedTuple):
+    fileset: pathlib.Path
+    disk_used: int
+    files_used: int
+    fileset_totals: UsageCSVDataFields
+
+def build_usage_index(csv_paths: list[pathlib.Path]) -> dict:
+    """
+    Reads every usage csv once and inverts it, so that each user and group
+    maps to the filesets they use:
+        usage_index["user"]["alice"] = [FilesetUsageEntry(...), ...]
+    Filesets we can't read are skipped, and ones we can't parse are reported
+    on stderr and skipped.
+    """
+    usage_index = {"user": defaultdict(list), "group": defaultdict(list)}
+    for csv_path in csv_paths:
+        try:
+            parsed_csv = parse_usage_csv(csv_path)
+        except (PermissionError, FileNotFoundError):
+            continue
+        except (csv.Error, IndexError, TypeError, ValueError) as parse_error:
+            print(f"error: can't parse '{csv_path}': {parse_error}", file=sys.stderr)
+            continue
+        fileset_totals = parsed_csv["fileset"]
+        if not fileset_totals:
+            continue
+        for index_type, index_for_type in usage_index.items():
+            for value, data_fields in parsed_csv[index_type].items():
+                index_for_type[value].append(FilesetUsageEntry(
+                    csv_path.parent, data_fields.disk_used, data_fields.files_used, fileset_totals))
+    return usage_index
+
+def make_who_rows(entries: list[FilesetUsageEntry], args: argparse.Namespace) -> list[UsageReportRow]:
+    if args.sort_by_files:
+        sorted_entries = sorted(entries, reverse=True, key=lambda entry: entry.files_used)
+    else:
+        sorted_entries = sorted(entries, reverse=True, key=lambda entry: entry.disk_used)
+    who_rows = []
+    for entry in sorted_entries:
+        disk_headroom = entry.fileset_totals.disk_quota - entry.fileset_totals.disk_used
+        files_headroom = entry.fileset_totals.files_quota - entry.fileset_totals.files_used
+        who_rows.append(UsageReportRow(str(entry.fileset),
+            f"{entry.disk_used}GB ({disk_headroom}GB free)",
+            f"{entry.files_used} files ({files_headroom} free)"))
+    return who_rows
+
+def print_who_report(user_arguments: argparse.Namespace) -> None:
+    if user_arguments.who_user:
+        index_type, who = "user", user_arguments.who_user
+    else:
+        index_type, who = "group", user_arguments.who_group
+    usage_index = build_usage_index(find_gscratch_csvs() + find_all_contrib_csvs())
+    entries = usage_index[index_type].get(who, [])
+    if not entries:
+        print(f"error: couldn't find any storage usage for {index_type} '{who}'")
+        return
+    total_disk = sum(entry.disk_used for entry in entries)
+    total_files = sum(entry.files_used for entry in entries)
+    who_rows = make_who_rows(entries, user_arguments)
+    who_rows.append(UsageReportRow("Total:", f"{total_disk}GB", f"{total_files} files"))
+    print_usage_table(UsageReportTable(f"Usage by {index_type} {who} across filesets:", who_rows))
+
+def find_my_visible_csvs() -> list[pathlib.Path]:
+    visible_csvs = []
+    homedir_csv = pathlib.Path.home() / CSV_FILENAME
+    if homedir_csv.exists():
+        visible_csvs.append(homedir_csv)
+    visible_csvs += find_gscratch_csvs()
+    visible_csvs += find_my_contrib_csvs()
+    return visible_csvs
+
+def get_homedir_user(csv_path: pathlib.Path) -> str:
+    """
+    Returns the owner's username if csv_path is a home directory's csv, else None.
+    """
+    if csv_path.parent == pathlib.Path.home() or check_if_homedir_csv(csv_path):
+        return csv_path.parent.name
+    return None
+
+def record_usage_history(csv_paths: list[pathlib.Path], history_path: pathlib.Path = HISTORY_PATH) -> None:
+    """
+    Appends each fileset's totals and per-user rows to the history file. Home
+    directories only get the owner's user line, like the usage reports. Each
+    line is: timestamp,fileset path,type,value,disk_used,disk_quota,files_used,files_quota
+    """
+    timestamp = int(time.time())
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    with history_path.open(mode="a", encoding="utf-8", newline="") as history_file:
+        history_writer = csv.writer(history_file)
+        for csv_path in csv_paths:
+            fileset_path = str(csv_path.parent)
+            homedir_user = get_homedir_user(csv_path)
+            try:
+                if homedir_user:
+                    totals = read_fileset_totals(csv_path, homedir_user)
+                    if totals:
+                        history_writer.writerow((timestamp, fileset_path, "home", homedir_user, *totals))
+                    continue
+                parsed_csv = parse_usage_csv(csv_path)
+            except (PermissionError, FileNotFoundError):
+                continue
+            except (csv.Error, IndexError, TypeError, ValueError) as parse_error:
+                print(f"error: can't parse '{csv_path}': {parse_error}", file=sys.stderr)
+                continue
+            if parsed_csv["fileset"]:
+                history_writer.writerow((timestamp, fileset_path, "fileset", "", *parsed_csv["fileset"]))
+            for user, data_fields in parsed_csv["user"].items():
+                history_writer.writerow((timestamp, fileset_path, "user", user, *data_fields))
+
+def load_usage_history(history_path: pathlib.Path = HISTORY_PATH, users: set = None) -> tuple:
+    """
+    Reads the history file, returning the fileset (and home directory) totals
+    and the per-user rows (only for users, if given) as:
+        { "/mmfs1/gscratch/lab" : [(timestamp, UsageCSVDataFields), ...] }
+        { "/mmfs1/gscratch/lab" : { "alice" : [(timestamp, UsageCSVDataFields), ...] } }
+    """
+    fileset_history = defaultdict(list)
+    user_history = defaultdict(lambda: defaultdict(list))
+    if not history_path.exists():
+        return fileset_history, user_history
+    with history_path.open(mode="r", encoding="utf-8", newline="") as history_file:
+        for timestamp, fileset_path, line_type, value, *data_fields in csv.reader(history_file):
+            if line_type in ("fileset", "home"):
+                fileset_history[fileset_path].append(
+                    (int(timestamp), UsageCSVDataFields(*map(int, data_fields))))
+            elif line_type == "user" and (users is None or value in users):
+                user_history[fileset_path][value].append(
+                    (int(timestamp), UsageCSVDataFields(*map(int, data_fields))))
+    return fileset_history, user_history
+
+def fit_linear_slope(times: list[int], values: list[int]) -> float:
+    """
+    Least-squares slope of values over times, from running sums in one pass.
+    Returns 0.0 if there's not enough spread in time to fit a trend.
+    """
+    count = len(times)
+    if count < 2:
+        return 0.0
+    time_offset = times[0]
+    sum_t = sum_v = sum_tt = sum_tv = 0.0
+    for sample_time, value in zip(times, values):
+        shifted_time = sample_time - time_offset
+        sum_t += shifted_time
+        sum_v += value
+        sum_tt += shifted_time * shifted_time
+        sum_tv += shifted_time * value
+    denominator = count * sum_tt - sum_t * sum_t
+    if denominator == 0:
+        return 0.0
+    return (count * sum_tv - sum_t * sum_v) / denominator
+
+def days_until_quota(used: int, quota: int, slope_per_second: float):
+    """
+    Returns the estimated days until used reaches quota, or None if usage
+    isn't growing.
+    """
+    if slope_per_second <= 0:
+        return None
+    return max(quota - used, 0) / slope_per_second / SECONDS_PER_DAY
+
+def format_days_until_quota(days) -> str:
+    if days is None:
+        return "not growing"
+    return f"~{days:.0f} days until full"
+
+def format_growth(slope_per_second: float, unit: str) -> str:
+    return f"{slope_per_second * SECONDS_PER_DAY:+.1f}{unit}/day"
+
+def get_usage_slopes(samples: list) -> tuple[float]:
+    """
+    Sorts samples by time and returns the (disk, files) least-squares slopes.
+    """
+    samples.sort(key=lambda sample: sample[0])
+    times = [sample_time for sample_time, _ in samples]
+    disk_slope = fit_linear_slope(times, [data_fields.disk_used for _, data_fields in samples])
+    files_slope = fit_linear_slope(times, [data_fields.files_used for _, data_fields in samples])
+    return disk_slope, files_slope
+
+def make_forecast_table(fileset_path: str, samples: list, user_samples: dict = None) -> UsageReportTable:
+    """
+    Forecasts the fileset from its totals, then adds each user's growth rate
+    from user_samples ({ user : samples }) for users with enough history.
+    """
+    disk_slope, files_slope = get_usage_slopes(samples)
+    latest = samples[-1][1]
+    table_rows = make_totals_rows("Total:", latest)
+    table_rows.append(UsageReportRow("Forecast:",
+        format_days_until_quota(days_until_quota(latest.disk_used, latest.disk_quota, disk_slope)),
+        format_days_until_quota(days_until_quota(latest.files_used, latest.files_quota, files_slope))))
+    for user, samples_for_user in sorted((user_samples or {}).items()):
+        if len(samples_for_user) < 2:
+            continue
+        user_disk_slope, user_files_slope = get_usage_slopes(samples_for_user)
+        table_rows.append(UsageReportRow(f"{user} growth:",
+            format_growth(user_disk_slope, "GB"), format_growth(user_files_slope, " files")))
+    return UsageReportTable(pathlib.Path(fileset_path), table_rows)
+
+def print_forecast_reports(user_arguments: argparse.Namespace) -> None:
+    """
+    Forecasts every fileset I can see, with my own growth rate under each
+    (or every user's, with -u).
+    """
+    users = None if user_arguments.show_usage_by_user else {getpass.getuser()}
+    fileset_history, user_history = load_usage_history(users=users)
+    for csv_path in find_my_visible_csvs():
+        fileset_path = str(csv_path.parent)
+        samples = fileset_history.get(fileset_path, [])
+        if len(samples) < 2:
+            print(f"error: not enough history to forecast '{fileset_path}', run with --record-history")
+            continue
+        print_usage_table(make_forecast_table(fileset_path, samples, user_history.get(fileset_path)))
+
+class SweepOffender(NamedTuple):
+    fileset: str
+    disk_used: int
+    disk_quota: int
+    files_used: int
+    files_quota: int
+    disk_fraction: float
+    files_fraction: float
+    top_consumers: list
+
+def get_quota_fraction(used: int, quota: int) -> float:
+    return used / quota if quota else 0.0
+
+def sweep_fileset(csv_path: pathlib.Path, is_homedir: bool, threshold: float) -> SweepOffender:
+    """
+    Checks a single fileset against the threshold. Only the fileset line is
+    read unless the fileset is over the threshold, in which case the full csv
+    is parsed to find the top consumers. A csv that can't be read or parsed is
+    skipped (and reported on stderr) so the rest of the sweep still runs.
+    """
+    homedir_user = csv_path.parent.name if is_homedir else None
+    try:
+        totals = read_fileset_totals(csv_path, homedir_user)
+        if totals is None:
+            return None
+        disk_fraction = get_quota_fraction(totals.disk_used, totals.disk_quota)
+        files_fraction = get_quota_fraction(totals.files_used, totals.files_quota)
+        if max(disk_fraction, files_fraction) < threshold:
+            return None
+        parsed_csv = parse_usage_csv(csv_path)
+    except (PermissionError, FileNotFoundError):
+        return None
+    except (csv.Error, IndexError, TypeError, ValueError) as parse_error:
+        print(f"error: can't parse '{csv_path}': {parse_error}", file=sys.stderr)
+        return None
+    sort_key = (lambda item: item[1].disk_used) if disk_fraction >= files_fraction \
+        else (lambda item: item[1].files_used)
+    top_users = sorted(parsed_csv["user"].items(), reverse=True, key=sort_key)[:SWEEP_TOP_CONSUMERS]
+    return SweepOffender(
+        str(csv_path.parent), *totals, round(disk_fraction, 4), round(files_fraction, 4),
+        [{"user": user, "disk_used": data.disk_used, "files_used": data.files_used}
+            for user, data in top_users])
+
+def run_sweep(threshold: float) -> list[SweepOffender]:
+    sweep_targets = [(csv_path, False) for csv_path in find_gscratch_csvs() + find_all_contrib_csvs()]
+    sweep_targets += [(csv_path, True) for csv_path in find_all_homedir_csvs()]
+    with ThreadPoolExecutor(max_workers=SWEEP_WORKERS) as executor:
+        results = executor.map(lambda target: sweep_fileset(*target, threshold), sweep_targets)
+        offenders = [offender for offender in results if offender]
+    offenders.sort(reverse=True, key=lambda offender: max(offender.disk_fraction, offender.files_fraction))
+    return offenders
+
+def print_sweep_report(user_arguments: argparse.Namespace) -> None:
+    offenders = run_sweep(user_arguments.threshold)
+    if user_arguments.output_format == "json":
+        json.dump([offender._asdict() for offender in offenders], sys.stdout, indent=2)
+        print()
+    elif user_arguments.output_format == "csv":
+        sweep_writer = csv.writer(sys.stdout)
+        sweep_writer.writerow(SweepOffender._fields)
+        for offender in offenders:
+            top_consumers = ";".join(consumer["user"] for consumer in offender.top_consumers)
+            sweep_writer.writerow((*offender[:-1], top_consumers))
+    else:
+        sweep_rows = []
+        for offender in offenders:
+            sweep_rows.extend(make_totals_rows(offender.fileset, UsageCSVDataFields(*offender[1:5])))
+            for consumer in offender.top_consumers:
+                sweep_rows.append(UsageReportRow(f"  {consumer['user']}",
+                    f"{consumer['disk_used']}GB", f"{consumer['files_used']} files"))
+        if sweep_rows:
+            print_usage_table(UsageReportTable(
+                f"Filesets above {user_arguments.threshold:.0%} of quota:", sweep_rows))
 
 def main():
     arguments = parse_arguments()
 
-    if arguments.search_for:
+    if arguments.sweep:
+        print_sweep_report(arguments)
+    elif arguments.output_format != "table":
+        print_usage_records(arguments)
+    elif arguments.record_history or arguments.forecast:
+        if arguments.record_history:
+            record_usage_history(find_my_visible_csvs())
+        if arguments.forecast:
+            print_forecast_reports(arguments)
+    elif arguments.who_user or arguments.who_group:
+        print_who_report(arguments)
+    elif arguments.search_for:
         parse_search_term_and_print_report(arguments)
     else:
         if arguments.print_my_homedir: